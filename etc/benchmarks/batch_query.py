@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Consistency check and benchmark of batch queries (POST /query/batch).
+
+Generates random resource shapes (data location, CPU cores, GPU model, memory and deadline, around
+the capacity of the example site) and, for each batch size, evaluates them both one by one with
+query_resources and at once with query_resources_batch. Checks that both give the same response
+code for every shape, and reports the time taken per batch and per shape by each as JSON.
+
+Usage: python etc/benchmarks/batch_query.py [--sizes 1 10 100 1000] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ["DATABASE_URL"] = "sqlite:///{}".format(
+    os.path.join(tempfile.mkdtemp(), "compute-batch-query.db")
+)
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "ska_src_compute_api", "rest"
+    ),
+)
+
+from ska_src_compute_api import models  # noqa: E402
+from response_example import MY_SITE, query_resources, query_resources_batch  # noqa: E402
+
+
+def generate_queries(count, rng):
+    return [
+        models.QueryInput(
+            data_location=rng.choice([MY_SITE.upper(), "ELSEWHERE"]),
+            data_size=rng.randint(1, 100000),
+            output_data_size=rng.randint(1, 10000),
+            memory=rng.randint(1, 150),
+            cpu_cores=rng.randint(1, 150),
+            runtime=rng.randint(1, 100),
+            gpu_model=rng.choice(list(models.QueryInput.GPU) + [None]),
+            deadline=datetime.now() + timedelta(days=rng.uniform(0, 10)),
+        )
+        for _ in range(count)
+    ]
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", help="numbers of shapes per batch", type=int, nargs="+",
+                        default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", help="number of timed runs per batch (the best is reported)",
+                        type=int, default=20)
+    parser.add_argument("--seed", help="seed for generating the shapes", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    for size in args.sizes:
+        queries = generate_queries(size, rng)
+        batch_input = models.BatchQueryInput(queries=queries)
+        scalar_s, scalar = best_of(
+            args.repeat, lambda: [query_resources(query) for query in queries]
+        )
+        batch_s, batch = best_of(args.repeat, lambda: query_resources_batch(batch_input))
+        mismatches = sum(
+            1
+            for response, response_code in zip(scalar, batch.response_codes)
+            if response.response_code != response_code
+        )
+        results.append(
+            {
+                "shapes": size,
+                "mismatches": mismatches,
+                "scalar_ms": round(scalar_s * 1000, 3),
+                "batch_ms": round(batch_s * 1000, 3),
+                "scalar_us_per_shape": round(scalar_s * 1e6 / size, 3),
+                "batch_us_per_shape": round(batch_s * 1e6 / size, 3),
+            }
+        )
+    print(json.dumps(results, indent=2))
+    if any(result["mismatches"] for result in results):
+        sys.exit("batch and scalar queries disagree")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Microbenchmark of provision id parsing.
+
+Compares the previous regex parser (re.match(".*-(\\d+).prov", ...)) with the IdentifierCodec,
+unsigned and signed, for valid ids and for long invalid ids (where the greedy regex backtracks).
+Results are printed as JSON, with times in microseconds per id. The codec itself is tested in
+tests/test_identifiers.py.
+
+Usage: python etc/benchmarks/identifiers.py [--repeat N]
+"""
+
+import argparse
+import json
+import re
+import timeit
+
+from ska_src_compute_api.common.exceptions import InvalidIdentifier
+from ska_src_compute_api.common.identifiers import IdentifierCodec, PROVISION
+
+
+def regex_decode(provision_id):
+    match = re.match(".*-(\\d+).prov", provision_id)
+    return int(match.group(1)) if match else None
+
+
+def codec_decode(codec, identifier, kind=PROVISION):
+    try:
+        return codec.decode(identifier, kind)
+    except InvalidIdentifier:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", help="number of ids per measurement", type=int,
+                        default=100000)
+    args = parser.parse_args()
+
+    codecs = {
+        "codec_unsigned": IdentifierCodec("spsrc"),
+        "codec_signed": IdentifierCodec("spsrc", key="benchmark"),
+    }
+    cases = {
+        "valid": {name: codec.encode(123456, PROVISION) for name, codec in codecs.items()},
+        "invalid_long": {name: "spsrc-" + "1-" * 100 + "x.prov" for name in codecs},
+    }
+    cases["valid"]["regex"] = cases["valid"]["codec_unsigned"]
+    cases["invalid_long"]["regex"] = cases["invalid_long"]["codec_unsigned"]
+
+    results = []
+    for case, identifiers in cases.items():
+        result = {"case": case}
+        for name, func in [
+            ("regex", regex_decode),
+            ("codec_unsigned", lambda i: codec_decode(codecs["codec_unsigned"], i)),
+            ("codec_signed", lambda i: codec_decode(codecs["codec_signed"], i)),
+        ]:
+            identifier = identifiers[name]
+            best = min(timeit.repeat(lambda: func(identifier), number=args.repeat, repeat=5))
+            result[name + "_us"] = round(best / args.repeat * 1e6, 3)
+        results.append(result)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""Benchmark of the provision -> submit -> status lifecycle.
+
+Drives <concurrency> concurrent workers, each running <iterations> lifecycles of:
+
+  POST /query -> PUT /provision -> PUT /provision/{id}/submit -> GET /provision/{id}/status (xN)
+
+and reports p50/p95/p99 latency and throughput per route as JSON.
+
+The API is run against a fresh sqlite database and the local stub IAM/Permissions API
+(etc/stubs/auth_api.py), with DISABLE_AUTHENTICATION=yes unless --authenticated is given, in which
+case route permissions are checked against the stub (with optional injected latency and errors).
+It is either imported and driven in-process (default), launched under uvicorn (--uvicorn), or an
+already running instance is targeted (--url). Multiple workers can be run either by uvicorn
+(--uvicorn --workers N) or by gunicorn with the app preloaded, as in production (--gunicorn
+--workers N); see etc/benchmarks/workers.py to compare worker counts.
+
+Usage: python etc/benchmarks/lifecycle.py [--concurrency 16] [--iterations 20] [--uvicorn]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import jwt
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+REST_DIR = os.path.join(ROOT_DIR, "src", "ska_src_compute_api", "rest")
+
+sys.path.insert(0, os.path.join(ROOT_DIR, "etc", "stubs"))
+import auth_api  # noqa: E402
+
+ROUTES = ["/query", "/provision", "/provision/{id}/submit", "/provision/{id}/status"]
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_api_environment(auth_url, database_path, authenticated=False):
+    return {
+        "DISABLE_AUTHENTICATION": "no" if authenticated else "yes",
+        "DATABASE_URL": "sqlite:///{}".format(database_path),
+        "IAM_CLIENT_CONF_URL": auth_url + "/.well-known/openid-configuration",
+        "API_IAM_CLIENT_ID": "benchmark",
+        "API_IAM_CLIENT_SECRET": "benchmark",
+        "PERMISSIONS_API_URL": auth_url + "/api/v1",
+        "PERMISSIONS_SERVICE_NAME": "compute-api",
+        "PERMISSIONS_SERVICE_VERSION": "1",
+    }
+
+
+def import_app(environment):
+    """Import the FastAPI app in-process with <environment>."""
+    os.environ.update(environment)
+    os.chdir(REST_DIR)
+    sys.path[:0] = [REST_DIR, os.path.join(ROOT_DIR, "src")]
+    import server
+
+    return server.app
+
+
+def start_server(environment, workers=1, server="uvicorn"):
+    """Launch the API under uvicorn or gunicorn (<server>), returning the process, the api url and
+    the startup time (until the API answers) once it is up.
+    """
+    port = get_free_port()
+    if server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "server:app", "--config",
+                   os.path.join(ROOT_DIR, "etc", "docker", "gunicorn.conf.py"),
+                   "--bind", "127.0.0.1:{}".format(port), "--workers", str(workers),
+                   "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=REST_DIR,
+        stdout=subprocess.DEVNULL,
+        env={**os.environ, **environment, "PYTHONPATH": os.pathsep.join(
+            filter(None, [os.path.join(ROOT_DIR, "src"), os.environ.get("PYTHONPATH")])
+        )},
+    )
+    api_url = "http://127.0.0.1:{}/v1".format(port)
+    for _ in range(600):
+        try:
+            if httpx.get(api_url + "/ping").status_code == 200:
+                return process, api_url, time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("{} did not start".format(server))
+
+
+async def run_lifecycle(client, token, polls, latencies, errors):
+    headers = {"Authorization": "Bearer {}".format(token)}
+    query = {
+        "data_location": "SPSRC",
+        "data_size": 100,
+        "output_data_size": 10,
+        "memory": 64,
+        "cpu_cores": 8,
+        "runtime": 1,
+        "gpu_model": "K40",
+        "deadline": (datetime.now() + timedelta(days=10)).isoformat(),
+    }
+    job = {
+        "container": "astroimaging/sourcefinder:3.4",
+        "dataset": "https://webdav.data.skao.int/3811823/dataproduct.fits",
+        "params": {"--maxiter": 1000},
+    }
+
+    async def timed(route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, headers=headers, **kwargs)
+            resp.raise_for_status()
+            return resp.json()
+        except Exception:
+            errors[route] += 1
+            return None
+        finally:
+            latencies[route].append(time.perf_counter() - start)
+
+    await timed("/query", "POST", "/query", json=query)
+    provision = await timed("/provision", "PUT", "/provision", json=query)
+    provision_id = (provision or {}).get("provision_id")
+    if not provision_id:
+        return
+    await timed("/provision/{id}/submit", "PUT",
+                "/provision/{}/submit".format(provision_id), json=job)
+    for _ in range(polls):
+        await timed("/provision/{id}/status", "GET",
+                    "/provision/{}/status".format(provision_id))
+
+
+async def run_benchmark(client, concurrency, iterations, polls, users):
+    latencies = {route: [] for route in ROUTES}
+    errors = {route: 0 for route in ROUTES}
+
+    async def worker(worker_id):
+        token = jwt.encode({"sub": "benchmark-user-{}".format(worker_id % users)}, "benchmark",
+                           algorithm="HS256")
+        for _ in range(iterations):
+            await run_lifecycle(client, token, polls, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(worker_id) for worker_id in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return summarise(latencies, errors, elapsed)
+
+
+def summarise(latencies, errors, elapsed):
+    def percentiles(values):
+        values = sorted(values)
+        if len(values) < 2:
+            return values * 3 if values else [None] * 3
+        cuts = statistics.quantiles(values, n=100, method="inclusive")
+        return [cuts[49], cuts[94], cuts[98]]
+
+    def to_ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    summary = {"elapsed_s": round(elapsed, 3), "routes": {}}
+    total = 0
+    for route, values in latencies.items():
+        p50, p95, p99 = percentiles(values)
+        summary["routes"][route] = {
+            "count": len(values),
+            "errors": errors[route],
+            "mean_ms": to_ms(statistics.fmean(values)) if values else None,
+            "p50_ms": to_ms(p50),
+            "p95_ms": to_ms(p95),
+            "p99_ms": to_ms(p99),
+            "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+        }
+        total += len(values)
+    summary["throughput_rps"] = round(total / elapsed, 2) if elapsed else None
+    return summary
+
+
+async def main(args):
+    process = None
+    startup = None
+    limits = httpx.Limits(max_connections=args.concurrency)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60)
+    else:
+        auth_url = args.auth_url
+        if not auth_url:
+            _, auth_url = auth_api.start(
+                policy=auth_api.Policy.from_file(args.auth_policy) if args.auth_policy else None,
+                latency_ms=args.auth_latency_ms,
+                latency_jitter_ms=args.auth_latency_jitter_ms,
+                error_rate=args.auth_error_rate,
+                seed=args.seed,
+            )
+        database_path = os.path.join(tempfile.mkdtemp(), "compute-benchmark.db")
+        environment = get_api_environment(auth_url, database_path, args.authenticated)
+        if args.uvicorn or args.gunicorn:
+            process, api_url, startup = start_server(
+                environment, workers=args.workers, server="gunicorn" if args.gunicorn else "uvicorn"
+            )
+            client = httpx.AsyncClient(base_url=api_url, limits=limits, timeout=60)
+        else:
+            client = httpx.AsyncClient(app=import_app(environment), base_url="http://benchmark/v1",
+                                       limits=limits, timeout=60)
+    try:
+        if args.warmup:
+            await run_benchmark(client, min(args.concurrency, 4), 1, args.polls, args.users)
+        summary = await run_benchmark(client, args.concurrency, args.iterations, args.polls,
+                                      args.users)
+    finally:
+        await client.aclose()
+        if process:
+            process.terminate()
+            process.wait()
+    summary["config"] = {
+        "mode": "url" if args.url
+        else "gunicorn" if args.gunicorn
+        else "uvicorn" if args.uvicorn
+        else "in-process",
+        "workers": args.workers if args.uvicorn or args.gunicorn else None,
+        "startup_s": round(startup, 3) if startup is not None else None,
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "polls": args.polls,
+        "users": args.users,
+        "authenticated": args.authenticated,
+        "auth_latency_ms": args.auth_latency_ms,
+        "auth_error_rate": args.auth_error_rate,
+    }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", help="number of concurrent workers", type=int,
+                        default=16)
+    parser.add_argument("--iterations", help="number of lifecycles per worker", type=int,
+                        default=20)
+    parser.add_argument("--polls", help="number of status polls per lifecycle", type=int,
+                        default=4)
+    parser.add_argument("--users", help="number of distinct token subjects", type=int, default=4)
+    parser.add_argument("--warmup", help="run a short warmup first", action="store_true")
+    parser.add_argument("--uvicorn", help="run the api under uvicorn", action="store_true")
+    parser.add_argument("--gunicorn", help="run the api under gunicorn (with uvicorn workers and "
+                        "the app preloaded)", action="store_true")
+    parser.add_argument("--workers", help="number of uvicorn/gunicorn workers", type=int,
+                        default=1)
+    parser.add_argument("--url", help="benchmark an already running api, e.g. "
+                        "http://localhost:8080/v1", type=str, default=None)
+    parser.add_argument("--authenticated", help="check route permissions against the "
+                        "IAM/Permissions API stub instead of setting DISABLE_AUTHENTICATION",
+                        action="store_true")
+    parser.add_argument("--auth-url", help="use an already running IAM/Permissions API stub",
+                        type=str, default=None)
+    parser.add_argument("--auth-policy", help="policy file for the IAM/Permissions API stub",
+                        type=str, default=None)
+    parser.add_argument("--auth-latency-ms", help="latency added by the IAM/Permissions API stub",
+                        type=float, default=0)
+    parser.add_argument("--auth-latency-jitter-ms", help="latency jitter added by the "
+                        "IAM/Permissions API stub", type=float, default=0)
+    parser.add_argument("--auth-error-rate", help="fraction of IAM/Permissions API stub requests "
+                        "answered with a 503", type=float, default=0)
+    parser.add_argument("--seed", help="random seed for the IAM/Permissions API stub", type=int,
+                        default=0)
+    parser.add_argument("--output", help="write the JSON report to this file", type=str,
+                        default=None)
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Microbenchmark of per-request response serialisation cost for job status payloads.
+
+Compares the previous path (parse_obj -> jsonable_encoder -> JSONResponse) with the current one
+(construct -> dict -> ORJSONResponse) for a range of job logging sizes. Results are printed as
+JSON, with times in microseconds per response.
+
+Usage: python etc/benchmarks/serialization.py [--repeat N] [--sizes 1024 102400 ...]
+"""
+
+import argparse
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from ska_src_compute_api.models import JobStatusResponse
+
+
+def make_status(logging_size):
+    line = "step1 | INFO:     Found 10 sources\n"
+    return {
+        "response_code": 1,
+        "response_text": "Running...",
+        "logging": (line * (logging_size // len(line) + 1))[:logging_size],
+        "output_data": "http://webdav.datastore.skao.int/surveyKSP/catalogue.dat",
+    }
+
+
+def validated_stdlib(status):
+    response = JobStatusResponse.parse_obj(status)
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def constructed_orjson(status):
+    response = JobStatusResponse.construct(**status)
+    return ORJSONResponse(response.dict()).body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", help="number of responses per measurement", type=int,
+                        default=1000)
+    parser.add_argument("--sizes", help="logging sizes (bytes)", type=int, nargs="+",
+                        default=[1024, 10240, 102400, 1048576])
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        status = make_status(size)
+        result = {"logging_size": size}
+        for name, func in [("validated_stdlib", validated_stdlib),
+                           ("constructed_orjson", constructed_orjson)]:
+            best = min(timeit.repeat(lambda: func(status), number=args.repeat, repeat=5))
+            result[name + "_us"] = round(best / args.repeat * 1e6, 2)
+        result["speedup"] = round(result["validated_stdlib_us"] / result["constructed_orjson_us"], 2)
+        results.append(result)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Concurrency check and benchmark of job status polling under contention.
+
+Creates <jobs> jobs in a fresh sqlite database, then has <pollers> threads poll the status of each
+job simultaneously (released together by a barrier), each with its own session as for separate
+requests. Since every poll advances the job by one stage, the stages reported for a job must be
+each stage of its flow exactly once, then the final stage for any further polls.
+
+Compares the previous read-modify-write update of JobStatus.flow_stage with the compare-and-swap
+in crud.get_job_status, reporting for each the number of jobs whose stages progressed correctly,
+the advances lost (a stage reported more than once), stages skipped, polls rejected (with a 503,
+after exhausting the compare-and-swap attempts; these neither report nor advance a stage) and the
+throughput.
+
+Usage: python etc/benchmarks/status_contention.py [--jobs 200] [--pollers 16]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+os.environ["DATABASE_URL"] = "sqlite:///{}".format(
+    os.path.join(tempfile.mkdtemp(), "compute-contention.db")
+)
+
+from ska_src_compute_api import models as api_models  # noqa: E402
+from ska_src_compute_api.common.data_locality import DataLocationIndex  # noqa: E402
+from ska_src_compute_api.common.exceptions import JobStatusContended  # noqa: E402
+from ska_src_compute_api.common.identifiers import IdentifierCodec, PROVISION  # noqa: E402
+from ska_src_compute_api.database import crud, models as db_models  # noqa: E402
+from ska_src_compute_api.database.database import engine, SessionLocal  # noqa: E402
+
+USER_ID = "benchmark-user"
+IDS = IdentifierCodec("spsrc")
+
+
+def create_jobs(count):
+    db_models.Base.metadata.create_all(bind=engine)
+    data_locations = DataLocationIndex([{"host": "skao.int", "sites": ["spsrc"]}])
+    query = api_models.QueryInput(
+        data_location="SPSRC",
+        data_size=1,
+        output_data_size=1,
+        memory=1,
+        cpu_cores=1,
+        runtime=1,
+        gpu_model="K40",
+        deadline=datetime.now() + timedelta(days=10),
+    )
+    job = api_models.JobInput(
+        container="astroimaging/sourcefinder:3.4",
+        dataset="https://webdav.data.skao.int/3811823/dataproduct.fits",
+        params={},
+    )
+    db = SessionLocal()
+    try:
+        provision_ids = []
+        for _ in range(count):
+            provision = crud.add_provision(db, query, USER_ID)
+            provision_id = IDS.encode(provision.id, PROVISION)
+            crud.add_job(db, job, provision_id, "spsrc", USER_ID, data_locations, IDS)
+            provision_ids.append(provision_id)
+        return provision_ids
+    finally:
+        db.close()
+
+
+def poll_read_modify_write(db, provision_id):
+    """The previous update: read the stage, increment it in Python and commit."""
+    job = (
+        db.query(db_models.Jobs)
+        .filter(db_models.Jobs.provision == IDS.decode(provision_id, PROVISION))
+        .first()
+    )
+    job_status = (
+        db.query(db_models.JobStatus).filter(db_models.JobStatus.job == job.id).first()
+    )
+    stages = len(crud.flows[job_status.flow])
+    stage = min(job_status.flow_stage, stages - 1)
+    if job_status.flow_stage < stages:
+        job_status.flow_stage += 1
+        db.commit()
+    return stage
+
+
+def poll_compare_and_swap(db, provision_id):
+    try:
+        _, (_, stage, _) = crud.get_job_status(db, provision_id, USER_ID, IDS)
+    except JobStatusContended:
+        return None
+    return stage
+
+
+def run(poll, provision_ids, pollers):
+    barrier = threading.Barrier(pollers)
+    stages = {provision_id: [] for provision_id in provision_ids}
+    lock = threading.Lock()
+
+    def poller():
+        for provision_id in provision_ids:
+            barrier.wait()
+            db = SessionLocal()
+            try:
+                stage = poll(db, provision_id)
+            finally:
+                db.close()
+            with lock:
+                stages[provision_id].append(stage)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=pollers) as executor:
+        for future in [executor.submit(poller) for _ in range(pollers)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    final_stage = len(crud.flows["happy_flow"]) - 1
+    consistent, lost, skipped, rejected = 0, 0, 0, 0
+    for polled in stages.values():
+        reported = [stage for stage in polled if stage is not None]
+        rejected += len(polled) - len(reported)
+        expected = list(range(min(len(reported), final_stage + 1))) + [final_stage] * (
+            len(reported) - final_stage - 1
+        )
+        counts = Counter(reported)
+        if sorted(reported) == expected:
+            consistent += 1
+        lost += sum(count - 1 for stage, count in counts.items() if stage < final_stage)
+        skipped += sum(1 for stage in range(final_stage) if stage not in counts)
+    polls = len(provision_ids) * pollers
+    return {
+        "jobs": len(provision_ids),
+        "jobs_consistent": consistent,
+        "lost_advances": lost,
+        "skipped_stages": skipped,
+        "rejected_polls": rejected,
+        "polls": polls,
+        "polls_per_s": round(polls / elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", help="number of jobs to poll", type=int, default=200)
+    parser.add_argument("--pollers", help="number of simultaneous pollers per job", type=int,
+                        default=16)
+    args = parser.parse_args()
+    if args.pollers < len(crud.flows["happy_flow"]):
+        sys.exit("--pollers must be at least the number of stages of a flow")
+
+    results = {}
+    for name, poll in [("read_modify_write", poll_read_modify_write),
+                       ("compare_and_swap", poll_compare_and_swap)]:
+        results[name] = run(poll, create_jobs(args.jobs), args.pollers)
+    print(json.dumps(results, indent=2))
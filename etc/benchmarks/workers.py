@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Benchmark of the lifecycle (see lifecycle.py) against the number of server workers.
+
+Runs the lifecycle benchmark with the API under gunicorn (uvicorn workers, app preloaded, as run
+in production with WORKERS set) and/or under uvicorn --workers (each worker importing the app
+itself), for each number of workers, and reports the startup time, overall throughput and
+per-route latency of each run as JSON.
+
+Usage: python etc/benchmarks/workers.py [--workers 1 2 4 8] [--servers gunicorn uvicorn]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import lifecycle  # noqa: E402
+
+
+def get_lifecycle_args(args, server, workers):
+    return argparse.Namespace(
+        concurrency=args.concurrency,
+        iterations=args.iterations,
+        polls=args.polls,
+        users=args.users,
+        warmup=True,
+        uvicorn=server == "uvicorn",
+        gunicorn=server == "gunicorn",
+        workers=workers,
+        url=None,
+        authenticated=args.authenticated,
+        auth_url=None,
+        auth_policy=None,
+        auth_latency_ms=args.auth_latency_ms,
+        auth_latency_jitter_ms=0,
+        auth_error_rate=0,
+        seed=0,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", help="numbers of workers to run", type=int, nargs="+",
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--servers", help="servers to run the api under", type=str, nargs="+",
+                        choices=["gunicorn", "uvicorn"], default=["gunicorn"])
+    parser.add_argument("--concurrency", help="number of concurrent workers", type=int,
+                        default=32)
+    parser.add_argument("--iterations", help="number of lifecycles per worker", type=int,
+                        default=10)
+    parser.add_argument("--polls", help="number of status polls per lifecycle", type=int,
+                        default=4)
+    parser.add_argument("--users", help="number of distinct token subjects", type=int, default=4)
+    parser.add_argument("--authenticated", help="check route permissions against the "
+                        "IAM/Permissions API stub", action="store_true")
+    parser.add_argument("--auth-latency-ms", help="latency added by the IAM/Permissions API stub",
+                        type=float, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file", type=str,
+                        default=None)
+    args = parser.parse_args()
+
+    results = []
+    for server in args.servers:
+        for workers in args.workers:
+            summary = asyncio.run(lifecycle.main(get_lifecycle_args(args, server, workers)))
+            results.append(
+                {
+                    "server": server,
+                    "workers": workers,
+                    "startup_s": summary["config"]["startup_s"],
+                    "throughput_rps": summary["throughput_rps"],
+                    "routes": {
+                        route: {
+                            key: values[key] for key in ("errors", "p50_ms", "p95_ms", "p99_ms")
+                        }
+                        for route, values in summary["routes"].items()
+                    },
+                }
+            )
+            print(json.dumps(results[-1]), file=sys.stderr, flush=True)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
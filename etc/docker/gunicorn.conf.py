@@ -0,0 +1,22 @@
+# Gunicorn configuration for running the API with multiple uvicorn workers (see init.sh).
+#
+# The app is imported once in the master process before the workers are forked (preload_app), so
+# that the IAM configuration, the database schema, the openapi schemas and their code samples
+# are fetched/built once and shared by the workers. Resources that must not be shared between
+# processes are re-created in each worker after the fork (see post_fork).
+#
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("WORKERS") or 1)
+worker_class = "ska_src_compute_api.common.workers.RootPathUvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("WORKER_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+
+def post_fork(arbiter, worker):
+    from server import reinitialise_after_fork
+
+    reinitialise_after_fork()
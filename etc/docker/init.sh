@@ -7,6 +7,14 @@ cd src/ska_src_compute_api/rest
 
 env
 
+# with WORKERS set, run that many uvicorn workers under gunicorn, with the app preloaded (see
+# gunicorn.conf.py), otherwise a single uvicorn process that reloads on changes (for development)
+if [ ! -z "$WORKERS" ]; then
+  cmd="gunicorn server:app --config ../../../etc/docker/gunicorn.conf.py"
+  echo $cmd
+  exec $cmd
+fi
+
 # set the root path for openapi docs (https://fastapi.tiangolo.com/advanced/behind-a-proxy/)
 # this should match any proxy path redirect
 cmd="server:app --host "0.0.0.0" --port 8080 --reload --reload-dir ../database/ --reload-dir ../models/ --reload-dir ../client/ --reload-dir ../rest/ --reload-dir ../common/ --reload-dir ../../../etc/ --reload-include *.json"
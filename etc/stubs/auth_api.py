@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""Lightweight stand-in for the IAM and Permissions APIs, for offline development and load testing.
+
+Serves:
+
+- the IAM well-known openid configuration (/.well-known/openid-configuration), plus minimal
+  /token and /introspect endpoints,
+- the Permissions API /ping and /health endpoints, and
+- route authorisation for any path containing "authorise", decided from a policy file.
+
+Latency and errors can be injected into every response (other than the well-known configuration)
+to measure the behaviour of the auth path under degraded dependencies. A fixed --seed makes error
+injection deterministic.
+
+Policy files are JSON of the form:
+
+    {
+      "default": true,
+      "rules": [
+        {"route": "/provision", "method": "PUT", "allow": false},
+        {"route": "/provision/{provision_id}/status", "subs": ["user-1"], "allow": true}
+      ]
+    }
+
+Rules are evaluated in order and the first matching rule (all given keys equal) wins.
+
+Usage: python etc/stubs/auth_api.py [--port 8081] [--latency-ms 20] [--error-rate 0.01]
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+def get_token_subject(token):
+    """Get the (unverified) sub claim from a JWT, <token>."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("sub")
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class Policy:
+    def __init__(self, default=True, rules=None):
+        self.default = default
+        self.rules = rules or []
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            policy = json.load(f)
+        return cls(default=policy.get("default", True), rules=policy.get("rules", []))
+
+    def is_authorised(self, route, method, sub):
+        for rule in self.rules:
+            if "route" in rule and rule["route"] != route:
+                continue
+            if "method" in rule and rule["method"].upper() != (method or "").upper():
+                continue
+            if "subs" in rule and sub not in rule["subs"]:
+                continue
+            return bool(rule.get("allow", True))
+        return self.default
+
+
+class AuthAPI:
+    """Configuration and state shared by all request handlers."""
+
+    def __init__(self, policy=None, latency_ms=0, latency_jitter_ms=0, error_rate=0, seed=None):
+        self.policy = policy or Policy()
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests_counter = 0
+        self.errors_counter = 0
+
+    def sample(self):
+        """Get the (delay in seconds, whether to inject an error) for a request."""
+        with self.random_lock:
+            self.requests_counter += 1
+            jitter = self.random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+            error = self.random.random() < self.error_rate
+            if error:
+                self.errors_counter += 1
+        return max(0.0, self.latency_ms + jitter) / 1000, error
+
+
+def make_handler(auth_api):
+    class AuthAPIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status_code, body):
+            content = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                return {}
+            return body if isinstance(body, dict) else {}
+
+        def _reply(self):
+            url = urlparse(self.path)
+            params = dict(parse_qsl(url.query))
+            body = self._read_body()
+            base_url = "http://{}".format(self.headers.get("Host"))
+
+            if url.path.endswith("/.well-known/openid-configuration"):
+                self._send_json(200, {
+                    "issuer": base_url,
+                    "authorization_endpoint": base_url + "/authorize",
+                    "token_endpoint": base_url + "/token",
+                    "introspection_endpoint": base_url + "/introspect",
+                })
+                return
+
+            delay, error = auth_api.sample()
+            if delay:
+                time.sleep(delay)
+            if error:
+                self._send_json(503, {"detail": "Injected error."})
+                return
+
+            path = url.path.rstrip("/")
+            if path.endswith("/ping"):
+                self._send_json(200, {"status": "UP", "version": "stub"})
+            elif path.endswith("/health"):
+                self._send_json(200, {
+                    "uptime": 0,
+                    "number_of_managed_requests": auth_api.requests_counter,
+                    "number_of_injected_errors": auth_api.errors_counter,
+                })
+            elif path.endswith("/token"):
+                self._send_json(200, {"access_token": "stub", "token_type": "Bearer",
+                                      "expires_in": 3600})
+            elif path.endswith("/introspect"):
+                self._send_json(200, {"active": True})
+            elif "authorise" in path:
+                token = params.get("token") or body.get("token")
+                if not token:
+                    token = self.headers.get("Authorization", "").replace("Bearer ", "")
+                route = params.get("route") or body.get("route")
+                method = params.get("method") or body.get("method") or self.command
+                self._send_json(200, {
+                    "is_authorised": auth_api.policy.is_authorised(
+                        route, method, get_token_subject(token)
+                    )
+                })
+            else:
+                self._send_json(404, {"detail": "Not found."})
+
+        do_GET = do_POST = do_PUT = do_DELETE = _reply
+
+        def log_message(self, *args):
+            pass
+
+    return AuthAPIHandler
+
+
+def start(host="127.0.0.1", port=0, **kwargs):
+    """Start the stub in a background thread, returning (server, base url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(AuthAPI(**kwargs)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}".format(host, server.server_address[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="host to bind to", type=str, default="0.0.0.0")
+    parser.add_argument("--port", help="port to bind to", type=int, default=8081)
+    parser.add_argument("--policy", help="JSON policy file (default: allow all)", type=str,
+                        default=None)
+    parser.add_argument("--latency-ms", help="mean latency to add to each response", type=float,
+                        default=0)
+    parser.add_argument("--latency-jitter-ms", help="uniform jitter to add to the latency",
+                        type=float, default=0)
+    parser.add_argument("--error-rate", help="fraction of requests answered with a 503",
+                        type=float, default=0)
+    parser.add_argument("--seed", help="random seed for latency jitter and error injection",
+                        type=int, default=None)
+    args = parser.parse_args()
+
+    auth_api = AuthAPI(
+        policy=Policy.from_file(args.policy) if args.policy else None,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(auth_api))
+    server.daemon_threads = True
+    print("stub IAM/Permissions API listening on {}:{}".format(args.host, args.port), flush=True)
+    server.serve_forever()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""Lightweight stand-in for a compute site's /query endpoint, for testing the federation broker.
+
+Answers availability queries (POST .../query) in the same way as the example site in
+response_example.py, but against a configurable capacity. Latency and errors can be injected as
+for the IAM/Permissions API stub.
+
+Stub sites can be started either one at a time:
+
+    python etc/stubs/compute_site.py --name site-a --port 8091 --available-cpu-cores 10
+
+or all together from a federation site registry (etc/stubs/sites.json), in which case each site
+with a local url is started with its data locations and the capacity given in its (optional)
+"stub" entry:
+
+    python etc/stubs/compute_site.py --sites etc/stubs/sites.json
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class ComputeSite:
+    """Capacity and behaviour of a stub site."""
+
+    def __init__(self, name="site", data_locations=None, cpu_cores=100, available_cpu_cores=40,
+                 memory=100, gpu_models=("K40", "RX7900XT"), latency_ms=0, error_rate=0,
+                 seed=None):
+        self.name = name
+        self.data_locations = [location.upper() for location in data_locations or [name]]
+        self.cpu_cores = cpu_cores
+        self.available_cpu_cores = available_cpu_cores
+        self.memory = memory
+        self.gpu_models = list(gpu_models)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests_counter = 0
+
+    def sample_error(self):
+        with self.random_lock:
+            self.requests_counter += 1
+            return self.random.random() < self.error_rate
+
+    def query(self, query):
+        """Get the (response code, response text) for a QueryInput-like dict, <query>.
+
+        As for a real site, queries for data locations the site does not hold are answered with
+        code 4 (if the resources are available).
+        """
+        unavailable = []
+        if query.get("cpu_cores", 0) > self.cpu_cores:
+            unavailable.append("Number of requested CPU cores not available.")
+        if query.get("gpu_model") not in self.gpu_models + ["none", None]:
+            unavailable.append("{} GPU not available".format(query.get("gpu_model")))
+        if query.get("memory", 0) > self.memory:
+            unavailable.append("Requested memory not available")
+        if unavailable:
+            return 1, " ".join(unavailable)
+        try:
+            deadline = datetime.fromisoformat(query.get("deadline"))
+        except (TypeError, ValueError):
+            deadline = datetime.now()
+        if (
+            query.get("cpu_cores", 0) > self.available_cpu_cores
+            and deadline.replace(tzinfo=None) < datetime.now() + timedelta(days=5)
+        ):
+            return 2, "Number of requested CPU cores not bookable."
+        if str(query.get("data_location", "")).upper() not in self.data_locations:
+            return 4, "Data location {} not held at this site.".format(query.get("data_location"))
+        return 0, "Ok"
+
+
+def make_handler(site):
+    class ComputeSiteHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status_code, body):
+            content = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                return {}
+            return body if isinstance(body, dict) else {}
+
+        def _reply(self):
+            path = urlparse(self.path).path.rstrip("/")
+            body = self._read_body()
+            if path.endswith("/ping"):
+                self._send_json(200, {"status": "UP", "version": "stub"})
+                return
+            if not path.endswith("/query"):
+                self._send_json(404, {"detail": "Not found."})
+                return
+            if site.latency_ms:
+                time.sleep(site.latency_ms / 1000)
+            if site.sample_error():
+                self._send_json(503, {"detail": "Injected error."})
+                return
+            response_code, response_text = site.query(body)
+            self._send_json(200, {"response_code": response_code, "response_text": response_text})
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, *args):
+            pass
+
+    return ComputeSiteHandler
+
+
+def start(host="127.0.0.1", port=0, **kwargs):
+    """Start a stub site in a background thread, returning (server, base url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(ComputeSite(**kwargs)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}/v1".format(host, server.server_address[1])
+
+
+def start_from_registry(path, host="0.0.0.0"):
+    """Start a stub for each site in the registry at <path> with a local url."""
+    with open(path) as f:
+        registry = json.load(f)
+    servers = []
+    for entry in registry.get("sites", []):
+        url = urlparse(entry["url"])
+        if url.hostname not in ("localhost", "127.0.0.1") or not url.port:
+            continue
+        server, _ = start(
+            host=host,
+            port=url.port,
+            name=entry["name"],
+            data_locations=entry.get("data_locations"),
+            **entry.get("stub", {}),
+        )
+        servers.append(server)
+        print("stub compute site {} listening on {}:{}".format(entry["name"], host, url.port),
+              flush=True)
+    return servers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", help="federation site registry to start stubs for", type=str,
+                        default=None)
+    parser.add_argument("--host", help="host to bind to", type=str, default="0.0.0.0")
+    parser.add_argument("--port", help="port to bind to", type=int, default=8091)
+    parser.add_argument("--name", help="site name", type=str, default="site")
+    parser.add_argument("--data-locations", help="data locations held at the site (default: its "
+                        "name)", type=str, nargs="*", default=None)
+    parser.add_argument("--cpu-cores", help="total CPU cores", type=int, default=100)
+    parser.add_argument("--available-cpu-cores", help="CPU cores bookable now", type=int,
+                        default=40)
+    parser.add_argument("--memory", help="maximum memory (in GB)", type=int, default=100)
+    parser.add_argument("--gpu-models", help="available GPU models", type=str, nargs="*",
+                        default=["K40", "RX7900XT"])
+    parser.add_argument("--latency-ms", help="latency to add to each query", type=float,
+                        default=0)
+    parser.add_argument("--error-rate", help="fraction of queries answered with a 503",
+                        type=float, default=0)
+    parser.add_argument("--seed", help="random seed for error injection", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.sites:
+        start_from_registry(args.sites, host=args.host)
+        threading.Event().wait()
+
+    site = ComputeSite(
+        name=args.name,
+        data_locations=args.data_locations,
+        cpu_cores=args.cpu_cores,
+        available_cpu_cores=args.available_cpu_cores,
+        memory=args.memory,
+        gpu_models=args.gpu_models,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(site))
+    server.daemon_threads = True
+    print("stub compute site {} listening on {}:{}".format(args.name, args.host, args.port),
+          flush=True)
+    server.serve_forever()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""Lightweight stand-in for an SMTP server, for testing email notifications.
+
+Accepts mail for any recipient (without authentication or TLS) and, instead of delivering it,
+writes each message as a JSON line (sender, recipients, subject, body and time of receipt) to
+stdout, or to a file if --output is given. Errors can be injected as for the other stubs: a
+fraction of messages is then refused with a temporary (451) failure.
+
+    python etc/stubs/smtp_server.py --port 8025 --output mail.jsonl
+
+and then run the API with SMTP_HOST=localhost and SMTP_PORT=8025.
+"""
+
+import argparse
+import json
+import random
+import socketserver
+import sys
+import threading
+from datetime import datetime
+from email import message_from_bytes, policy
+
+
+class Mailbox:
+    """Sink for received messages, with optional error injection."""
+
+    def __init__(self, output=None, error_rate=0, seed=None):
+        self.output = output
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages = []
+
+    def sample_error(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def deliver(self, sender, recipients, data):
+        message = message_from_bytes(data, policy=policy.default)
+        record = {
+            "time": datetime.now().isoformat(),
+            "from": sender,
+            "to": recipients,
+            "subject": message["Subject"],
+            "body": message.get_content() if not message.is_multipart() else None,
+        }
+        with self.lock:
+            self.messages.append(record)
+            line = json.dumps(record) + "\n"
+            if self.output:
+                with open(self.output, "a") as f:
+                    f.write(line)
+            else:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+
+def make_handler(mailbox):
+    class SMTPHandler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write((line + "\r\n").encode())
+            self.wfile.flush()
+
+        def read_data(self):
+            lines = []
+            while True:
+                line = self.rfile.readline()
+                if not line or line.rstrip(b"\r\n") == b".":
+                    return b"".join(lines)
+                if line.startswith(b".."):  # dot-stuffing
+                    line = line[1:]
+                lines.append(line)
+
+        def handle(self):
+            sender, recipients = None, []
+            self.reply("220 localhost stub SMTP server")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command, _, argument = line.decode(errors="replace").strip().partition(" ")
+                command = command.upper()
+                if command == "EHLO":
+                    self.reply("250-localhost")
+                    self.reply("250 8BITMIME")
+                elif command == "HELO":
+                    self.reply("250 localhost")
+                elif command == "MAIL":
+                    sender, recipients = argument.partition(":")[2].strip("<> "), []
+                    self.reply("250 OK")
+                elif command == "RCPT":
+                    recipients.append(argument.partition(":")[2].strip("<> "))
+                    self.reply("250 OK")
+                elif command == "DATA":
+                    if not recipients:
+                        self.reply("503 No recipients")
+                        continue
+                    self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = self.read_data()
+                    if mailbox.sample_error():
+                        self.reply("451 Injected error")
+                    else:
+                        mailbox.deliver(sender, recipients, data)
+                        self.reply("250 OK")
+                    sender, recipients = None, []
+                elif command == "RSET":
+                    sender, recipients = None, []
+                    self.reply("250 OK")
+                elif command == "NOOP":
+                    self.reply("250 OK")
+                elif command == "QUIT":
+                    self.reply("221 Bye")
+                    return
+                else:
+                    self.reply("502 Command not implemented")
+
+    return SMTPHandler
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start(host="127.0.0.1", port=0, **kwargs):
+    """Start a stub SMTP server in a background thread, returning (server, mailbox, port)."""
+    mailbox = Mailbox(**kwargs)
+    server = SMTPServer((host, port), make_handler(mailbox))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, mailbox, server.server_address[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="host to bind to", type=str, default="0.0.0.0")
+    parser.add_argument("--port", help="port to bind to", type=int, default=8025)
+    parser.add_argument("--output", help="file to append messages to (default: stdout)",
+                        type=str, default=None)
+    parser.add_argument("--error-rate", help="fraction of messages refused with a 451",
+                        type=float, default=0)
+    parser.add_argument("--seed", help="random seed for error injection", type=int, default=None)
+    args = parser.parse_args()
+
+    server = SMTPServer(
+        (args.host, args.port),
+        make_handler(Mailbox(output=args.output, error_rate=args.error_rate, seed=args.seed)),
+    )
+    print("stub SMTP server listening on {}:{}".format(args.host, args.port), file=sys.stderr,
+          flush=True)
+    server.serve_forever()
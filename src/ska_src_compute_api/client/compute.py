@@ -1,18 +1,191 @@
-import requests
+import asyncio
+import heapq
 import json
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from ska_src_compute_api.common.exceptions import (
+    handle_async_client_exceptions,
+    handle_client_exceptions,
+)
+
+# Response status codes that are considered transient and worth retrying.
+#
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# HTTP methods that are always retried. Other requests are only retried if they have no side
+# effects (POST /query) or carry an Idempotency-Key (PUT provision/submit), as a retry after the
+# service acted on the original request would otherwise provision or submit twice.
+#
+RETRY_METHODS = frozenset(["GET"])
+
+# Job status response codes after which a job will not change again (see README).
+#
+TERMINAL_STATUS_CODES = frozenset([0, 2, 4, 5, 6])
+
+# Job status response code for internal (transient) errors.
+#
+INTERNAL_ERROR_STATUS_CODE = 3
+
+
+def _get_backoff(backoff_factor, attempt, headers=None):
+    """Get the time to wait before the next attempt, honouring any Retry-After header."""
+    retry_after = headers.get("Retry-After") if headers is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return backoff_factor * (2 ** attempt)
+
+
+class _WatchSchedule:
+    """Polling schedule for a set of provision ids, shared by the sync and async watchers.
+
+    Each id is polled at an interval that starts at <min_interval> and is multiplied by
+    <backoff_multiplier> (up to <max_interval>) every time a poll returns an unchanged status. A
+    change of status resets the interval. Internal errors (response code 3) and failed requests
+    back off immediately to the maximum interval to take pressure off the service, and an id is
+    given up on after <max_errors> consecutive errors.
+    """
+
+    def __init__(
+        self, provision_ids, min_interval, max_interval, backoff_multiplier, max_errors
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_multiplier = backoff_multiplier
+        self.max_errors = max_errors
+        self.intervals = {}
+        self.last_status = {}
+        self.errors = {}
+        self.queue = []
+        now = time.monotonic()
+        for provision_id in dict.fromkeys(provision_ids):
+            self.intervals[provision_id] = min_interval
+            heapq.heappush(self.queue, (now, provision_id))
 
-from ska_src_compute_api.common.exceptions import handle_client_exceptions
+    def pop_due(self, limit):
+        """Pop up to <limit> ids that are due for polling."""
+        now = time.monotonic()
+        due = []
+        while self.queue and len(due) < limit and self.queue[0][0] <= now:
+            due.append(heapq.heappop(self.queue)[1])
+        return due
+
+    def time_to_next(self):
+        """Get the number of seconds until the next id is due, or None if nothing is scheduled."""
+        if not self.queue:
+            return None
+        return max(0.0, self.queue[0][0] - time.monotonic())
+
+    def update(self, provision_id, status):
+        """Record a poll result and reschedule the id.
+
+        :param str provision_id: The provision id that was polled.
+        :param dict status: The status response body, or None if the request failed.
+
+        :return: The status if it is a transition from the previously seen status, else None.
+        :rtype: dict
+        """
+        if status is None or status.get("response_code") == INTERNAL_ERROR_STATUS_CODE:
+            self.errors[provision_id] = self.errors.get(provision_id, 0) + 1
+            if self.errors[provision_id] < self.max_errors:
+                self.intervals[provision_id] = self.max_interval
+                self._reschedule(provision_id)
+            return status
+
+        self.errors.pop(provision_id, None)
+        previous = self.last_status.get(provision_id)
+        key = (status.get("response_code"), status.get("response_text"), status.get("logging"))
+        self.last_status[provision_id] = key
+        if previous != key:
+            self.intervals[provision_id] = self.min_interval
+        else:
+            self.intervals[provision_id] = min(
+                self.max_interval, self.intervals[provision_id] * self.backoff_multiplier
+            )
+        if status.get("response_code") not in TERMINAL_STATUS_CODES:
+            self._reschedule(provision_id)
+        return status if previous != key else None
+
+    def _reschedule(self, provision_id):
+        heapq.heappush(
+            self.queue, (time.monotonic() + self.intervals[provision_id], provision_id)
+        )
 
 
 class ComputeClient:
-    def __init__(self, api_url, session=None, token=None):
-        self.api_url = api_url
+    def __init__(
+        self,
+        api_url,
+        session=None,
+        token=None,
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=3,
+        backoff_factor=0.5,
+        timeout=(5, 30),
+    ):
+        """Synchronous client for the compute API.
+
+        :param str api_url: The base url of the api, e.g. https://compute.srcdev.skao.int/api/v1.
+        :param requests.Session session: An existing session to use (adapters are still mounted).
+        :param str token: A bearer token to add to the Authorization header.
+        :param int pool_connections: The number of connection pools to cache.
+        :param int pool_maxsize: The maximum number of connections to keep in each pool.
+        :param int max_retries: The number of retries on connection errors and 429/5xx responses
+            (see RETRY_METHODS).
+        :param float backoff_factor: The exponential backoff factor between retries (seconds).
+        :param timeout: The (connect, read) timeout in seconds passed to every request.
+        """
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
         if session:
             self.session = session
         else:
             self.session = requests.Session()
+        # retries are made by _request only (so that the adapter does not retry requests that
+        # are not safe to repeat, nor multiply the retries of those that are)
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=0,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         if token:
-            self.session.headers = {"Authorization": "Bearer {}".format(token)}
+            self.session.headers.update({"Authorization": "Bearer {}".format(token)})
+
+    def _request(self, method, url, retry=False, **kwargs):
+        """Make a request, retrying on connection errors, timeouts and 429/5xx responses.
+
+        Requests not using RETRY_METHODS are only retried if <retry> is set, i.e. if they are safe
+        to repeat.
+        """
+        retry = retry or method in RETRY_METHODS
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not retry or attempt >= self.max_retries:
+                    raise
+                time.sleep(_get_backoff(self.backoff_factor, attempt))
+            else:
+                if not retry or resp.status_code not in RETRY_STATUS_CODES or (
+                    attempt >= self.max_retries
+                ):
+                    return resp
+                time.sleep(_get_backoff(self.backoff_factor, attempt, resp.headers))
+            attempt += 1
 
     @handle_client_exceptions
     def health(self):
@@ -22,7 +195,7 @@ class ComputeClient:
         :rtype: requests.models.Response
         """
         health_endpoint = "{api_url}/health".format(api_url=self.api_url)
-        resp = self.session.get(health_endpoint)
+        resp = self._request("GET", health_endpoint)
         resp.raise_for_status()
         return resp
 
@@ -34,29 +207,401 @@ class ComputeClient:
         :rtype: requests.models.Response
         """
         ping_endpoint = "{api_url}/ping".format(api_url=self.api_url)
-        resp = self.session.get(ping_endpoint)
+        resp = self._request("GET", ping_endpoint)
         resp.raise_for_status()
         return resp
 
     @handle_client_exceptions
-    def query(self, query_params:dict):
+    def query(self, query_params: dict):
+        """Query for general compute availability.
+
+        :param dict query_params: The query parameters (see QueryInput).
+
+        :return: A requests response.
+        :rtype: requests.models.Response
+        """
         query_endpoint = "{api_url}/query".format(api_url=self.api_url)
-        resp = self.session.post(query_endpoint, json=query_params)
+        resp = self._request(
+            "POST", query_endpoint, retry=True, data=json.dumps(query_params, default=str),
+            headers={"Content-Type": "application/json"}
+        )
         resp.raise_for_status()
         return resp
 
-    def provision(self, provision_params:dict):
+    @handle_client_exceptions
+    def provision(self, provision_params: dict, idempotency_key: str = None):
+        """Query for availability and provision resources.
+
+        :param dict provision_params: The provision parameters (see QueryInput).
+        :param str idempotency_key: A key making retries of this request return the original
+            response rather than provisioning again (default: a new key, so that only the
+            client's own retries are deduplicated).
+
+        :return: A requests response.
+        :rtype: requests.models.Response
+        """
         provision_endpoint = "{api_url}/provision".format(api_url=self.api_url)
-        resp = self.session.put(provision_endpoint, json=provision_params)
+        headers = {
+            "Content-Type": "application/json",
+            "Idempotency-Key": idempotency_key or str(uuid.uuid4()),
+        }
+        resp = self._request(
+            "PUT", provision_endpoint, retry=True,
+            data=json.dumps(provision_params, default=str), headers=headers
+        )
         resp.raise_for_status()
         return resp
 
-    def submit(self, provision_id:str, job_params:dict):
-        submit_endpoint = "{api_url}/{provision_id}/submit".format(api_url=self.api_url, provision_id=provision_id)
-        resp = self.session.put(submit_endpoint, json=job_params)
+    @handle_client_exceptions
+    def submit(self, provision_id: str, job_params: dict, idempotency_key: str = None):
+        """Submit a job against a provision.
+
+        :param str provision_id: The provision id, e.g. spsrc-1.prov.
+        :param dict job_params: The job parameters (see JobInput).
+        :param str idempotency_key: A key making retries of this request return the original
+            response rather than submitting again (default: a new key, so that only the client's
+            own retries are deduplicated).
+
+        :return: A requests response.
+        :rtype: requests.models.Response
+        """
+        submit_endpoint = "{api_url}/provision/{provision_id}/submit".format(
+            api_url=self.api_url, provision_id=provision_id
+        )
+        headers = {"Idempotency-Key": idempotency_key or str(uuid.uuid4())}
+        resp = self._request(
+            "PUT", submit_endpoint, retry=True, json=job_params, headers=headers
+        )
+        resp.raise_for_status()
         return resp
 
-    def status(self, provision_id:str):
-        status_endpoint = "{api_url}/{provision_id}/status".format(api_url=self)
-        resp = self.session.get(status_endpoint)
+    @handle_client_exceptions
+    def status(self, provision_id: str):
+        """Get the status of the job submitted against a provision.
+
+        :param str provision_id: The provision id, e.g. spsrc-1.prov.
+
+        :return: A requests response.
+        :rtype: requests.models.Response
+        """
+        status_endpoint = "{api_url}/provision/{provision_id}/status".format(
+            api_url=self.api_url, provision_id=provision_id
+        )
+        resp = self._request("GET", status_endpoint)
+        resp.raise_for_status()
         return resp
+
+    def watch(
+        self,
+        provision_ids,
+        min_interval=1,
+        max_interval=60,
+        backoff_multiplier=2,
+        max_in_flight=8,
+        timeout=None,
+        max_errors=5,
+    ):
+        """Watch the status of jobs for many provisions, yielding status transitions.
+
+        Ids are polled with an adaptive interval (see _WatchSchedule) and stop being polled once
+        a terminal response code is seen (or after <max_errors> consecutive errors). At most
+        <max_in_flight> status requests are made concurrently. On timeout, the generator returns
+        straight away, without waiting for requests still in flight.
+
+        The service has no streaming or batched status endpoint yet, so each id is polled
+        individually via the status route.
+
+        :param list provision_ids: The provision ids to watch.
+        :param float min_interval: The minimum polling interval per id (seconds).
+        :param float max_interval: The maximum polling interval per id (seconds).
+        :param float backoff_multiplier: The interval multiplier applied when status is unchanged.
+        :param int max_in_flight: The maximum number of concurrent status requests.
+        :param float timeout: Stop watching after this many seconds (default: no timeout).
+        :param int max_errors: Stop polling an id after this many consecutive failed requests or
+            internal errors.
+
+        :return: A generator of (provision_id, status) tuples. Status is the response body, or
+            None if the request failed.
+        :rtype: generator
+        """
+        schedule = _WatchSchedule(
+            provision_ids, min_interval, max_interval, backoff_multiplier, max_errors
+        )
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        try:
+            while schedule.queue or in_flight:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                for provision_id in schedule.pop_due(max_in_flight - len(in_flight)):
+                    in_flight[executor.submit(self.status, provision_id)] = provision_id
+                wait_for = schedule.time_to_next()
+                if len(in_flight) >= max_in_flight or wait_for is None:
+                    wait_for = None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - time.monotonic())
+                    wait_for = remaining if wait_for is None else min(wait_for, remaining)
+                if not in_flight:
+                    time.sleep(wait_for or 0)
+                    continue
+                done, _ = wait(in_flight, timeout=wait_for, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provision_id = in_flight.pop(future)
+                    try:
+                        status = future.result().json()
+                    except Exception:
+                        status = None
+                    transition = schedule.update(provision_id, status)
+                    if transition is not None or status is None:
+                        yield provision_id, transition
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def close(self):
+        """Close the underlying session and release pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncComputeClient:
+    def __init__(
+        self,
+        api_url,
+        client=None,
+        token=None,
+        max_connections=100,
+        max_keepalive_connections=20,
+        max_retries=3,
+        backoff_factor=0.5,
+        timeout=30,
+    ):
+        """Asynchronous (httpx) client for the compute API.
+
+        A single instance should be shared between tasks so that connections are pooled; the pool
+        size (max_connections) also acts as the upper bound on concurrent in-flight requests.
+
+        :param str api_url: The base url of the api, e.g. https://compute.srcdev.skao.int/api/v1.
+        :param httpx.AsyncClient client: An existing client to use.
+        :param str token: A bearer token to add to the Authorization header.
+        :param int max_connections: The maximum number of concurrent connections.
+        :param int max_keepalive_connections: The maximum number of idle connections to keep.
+        :param int max_retries: The number of retries on connection errors and 429/5xx responses
+            (see RETRY_METHODS).
+        :param float backoff_factor: The exponential backoff factor between retries (seconds).
+        :param float timeout: The timeout in seconds for each request.
+        """
+        self.api_url = api_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        if client:
+            self.client = client
+        else:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive_connections,
+                ),
+                timeout=timeout,
+            )
+        if token:
+            self.client.headers.update({"Authorization": "Bearer {}".format(token)})
+
+    async def _request(self, method, url, retry=False, **kwargs):
+        """Make a request, retrying on connection errors, read timeouts and 429/5xx responses.
+
+        Requests not using RETRY_METHODS are only retried if <retry> is set, i.e. if they are safe
+        to repeat; otherwise only failures to connect (before anything was sent) are retried.
+        """
+        retry = retry or method in RETRY_METHODS
+        attempt = 0
+        while True:
+            try:
+                resp = await self.client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout) as e:
+                if attempt >= self.max_retries or not (retry or isinstance(
+                    e, (httpx.ConnectError, httpx.ConnectTimeout)
+                )):
+                    raise
+                await asyncio.sleep(_get_backoff(self.backoff_factor, attempt))
+            else:
+                if not retry or resp.status_code not in RETRY_STATUS_CODES or (
+                    attempt >= self.max_retries
+                ):
+                    resp.raise_for_status()
+                    return resp
+                await asyncio.sleep(_get_backoff(self.backoff_factor, attempt, resp.headers))
+            attempt += 1
+
+    @handle_async_client_exceptions
+    async def health(self):
+        """Get the service health.
+
+        :return: A httpx response.
+        :rtype: httpx.Response
+        """
+        health_endpoint = "{api_url}/health".format(api_url=self.api_url)
+        return await self._request("GET", health_endpoint)
+
+    @handle_async_client_exceptions
+    async def ping(self):
+        """Ping the service.
+
+        :return: A httpx response.
+        :rtype: httpx.Response
+        """
+        ping_endpoint = "{api_url}/ping".format(api_url=self.api_url)
+        return await self._request("GET", ping_endpoint)
+
+    @handle_async_client_exceptions
+    async def query(self, query_params: dict):
+        """Query for general compute availability.
+
+        :param dict query_params: The query parameters (see QueryInput).
+
+        :return: A httpx response.
+        :rtype: httpx.Response
+        """
+        query_endpoint = "{api_url}/query".format(api_url=self.api_url)
+        return await self._request(
+            "POST", query_endpoint, retry=True, content=json.dumps(query_params, default=str),
+            headers={"Content-Type": "application/json"}
+        )
+
+    @handle_async_client_exceptions
+    async def provision(self, provision_params: dict, idempotency_key: str = None):
+        """Query for availability and provision resources.
+
+        :param dict provision_params: The provision parameters (see QueryInput).
+        :param str idempotency_key: A key making retries of this request return the original
+            response rather than provisioning again (default: a new key, so that only the
+            client's own retries are deduplicated).
+
+        :return: A httpx response.
+        :rtype: httpx.Response
+        """
+        provision_endpoint = "{api_url}/provision".format(api_url=self.api_url)
+        headers = {
+            "Content-Type": "application/json",
+            "Idempotency-Key": idempotency_key or str(uuid.uuid4()),
+        }
+        return await self._request(
+            "PUT", provision_endpoint, retry=True,
+            content=json.dumps(provision_params, default=str), headers=headers
+        )
+
+    @handle_async_client_exceptions
+    async def submit(self, provision_id: str, job_params: dict, idempotency_key: str = None):
+        """Submit a job against a provision.
+
+        :param str provision_id: The provision id, e.g. spsrc-1.prov.
+        :param dict job_params: The job parameters (see JobInput).
+        :param str idempotency_key: A key making retries of this request return the original
+            response rather than submitting again (default: a new key, so that only the client's
+            own retries are deduplicated).
+
+        :return: A httpx response.
+        :rtype: httpx.Response
+        """
+        submit_endpoint = "{api_url}/provision/{provision_id}/submit".format(
+            api_url=self.api_url, provision_id=provision_id
+        )
+        headers = {"Idempotency-Key": idempotency_key or str(uuid.uuid4())}
+        return await self._request(
+            "PUT", submit_endpoint, retry=True, json=job_params, headers=headers
+        )
+
+    @handle_async_client_exceptions
+    async def status(self, provision_id: str):
+        """Get the status of the job submitted against a provision.
+
+        :param str provision_id: The provision id, e.g. spsrc-1.prov.
+
+        :return: A httpx response.
+        :rtype: httpx.Response
+        """
+        status_endpoint = "{api_url}/provision/{provision_id}/status".format(
+            api_url=self.api_url, provision_id=provision_id
+        )
+        return await self._request("GET", status_endpoint)
+
+    async def watch(
+        self,
+        provision_ids,
+        min_interval=1,
+        max_interval=60,
+        backoff_multiplier=2,
+        max_in_flight=32,
+        timeout=None,
+        max_errors=5,
+    ):
+        """Watch the status of jobs for many provisions, yielding status transitions.
+
+        The async equivalent of ComputeClient.watch.
+
+        :param list provision_ids: The provision ids to watch.
+        :param float min_interval: The minimum polling interval per id (seconds).
+        :param float max_interval: The maximum polling interval per id (seconds).
+        :param float backoff_multiplier: The interval multiplier applied when status is unchanged.
+        :param int max_in_flight: The maximum number of concurrent status requests.
+        :param float timeout: Stop watching after this many seconds (default: no timeout).
+        :param int max_errors: Stop polling an id after this many consecutive failed requests or
+            internal errors.
+
+        :return: An async iterator of (provision_id, status) tuples. Status is the response body,
+            or None if the request failed.
+        :rtype: async_generator
+        """
+        schedule = _WatchSchedule(
+            provision_ids, min_interval, max_interval, backoff_multiplier, max_errors
+        )
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        in_flight = {}
+        try:
+            while schedule.queue or in_flight:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                for provision_id in schedule.pop_due(max_in_flight - len(in_flight)):
+                    task = asyncio.ensure_future(self.status(provision_id))
+                    in_flight[task] = provision_id
+                wait_for = schedule.time_to_next()
+                if len(in_flight) >= max_in_flight or wait_for is None:
+                    wait_for = None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - time.monotonic())
+                    wait_for = remaining if wait_for is None else min(wait_for, remaining)
+                if not in_flight:
+                    await asyncio.sleep(wait_for or 0)
+                    continue
+                done, _ = await asyncio.wait(
+                    in_flight, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    provision_id = in_flight.pop(task)
+                    try:
+                        status = task.result().json()
+                    except Exception:
+                        status = None
+                    transition = schedule.update(provision_id, status)
+                    if transition is not None or status is None:
+                        yield provision_id, transition
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def aclose(self):
+        """Close the underlying client and release pooled connections."""
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,162 @@
+import asyncio
+import re
+import time
+from collections import deque
+
+import orjson
+
+SHED_QUEUE_FULL = "queue_full"
+SHED_TIMEOUT = "timeout"
+
+
+class RouteClass:
+    """Requests matching one of <rules> ((method, path regex) pairs, with method None for any),
+    of which at most <limit> (0 for no limit) are in flight at once.
+
+    Further requests wait in a FIFO queue of at most <queue_size> requests for up to <max_wait>
+    seconds; requests that find the queue full or time out are shed.
+    """
+
+    def __init__(self, name, rules, limit=0, queue_size=0, max_wait=0.5):
+        self.name = name
+        self.rules = [(method, re.compile(path)) for method, path in rules]
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed = {SHED_QUEUE_FULL: 0, SHED_TIMEOUT: 0}
+        self.wait_seconds = 0.0
+
+    def matches(self, method, path):
+        return any(
+            (rule_method is None or rule_method == method) and rule_path.search(path)
+            for rule_method, rule_path in self.rules
+        )
+
+    async def acquire(self):
+        """Wait for a slot, returning None once admitted or the reason the request was shed."""
+        if not self.limit or (self.in_flight < self.limit and not self.waiters):
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if len(self.waiters) >= self.queue_size:
+            self.shed[SHED_QUEUE_FULL] += 1
+            return SHED_QUEUE_FULL
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait([waiter], timeout=self.max_wait)
+        except asyncio.CancelledError:  # e.g. the client disconnected
+            if waiter.done():  # a slot was handed over already: pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            raise
+        finally:
+            self.wait_seconds += time.perf_counter() - start
+        if not waiter.done():
+            waiter.cancel()
+            self.waiters.remove(waiter)
+            self.shed[SHED_TIMEOUT] += 1
+            return SHED_TIMEOUT
+        self.admitted += 1
+        return None
+
+    def release(self):
+        # hand the slot over to the first request still waiting, if any
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware limiting the requests in flight in this worker, by route class.
+
+    Each HTTP request is assigned to the first of <route_classes> matching its method and path
+    (requests matching none are not limited). Requests that cannot be admitted within their
+    class's limits are rejected straight away with a 503 and a Retry-After header of
+    <retry_after> seconds, rather than queueing until clients time out.
+    """
+
+    def __init__(self, app, route_classes, retry_after=1):
+        self.app = app
+        self.route_classes = route_classes
+        self.retry_after = retry_after
+
+    def classify(self, scope):
+        for route_class in self.route_classes:
+            if route_class.matches(scope["method"], scope["path"]):
+                return route_class
+        return None
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.classify(scope) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        if await route_class.acquire() is not None:
+            await self.reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release()
+
+    async def reject(self, send):
+        body = orjson.dumps({"detail": "Service overloaded, please retry later."})
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def render_metrics(route_classes, prefix="compute_api_admission"):
+    """Render the admission metrics of <route_classes> in the Prometheus text format."""
+    metrics = [
+        ("limit", "gauge", "Maximum requests in flight (0 for no limit).",
+         lambda route_class: [({}, route_class.limit)]),
+        ("in_flight", "gauge", "Requests in flight.",
+         lambda route_class: [({}, route_class.in_flight)]),
+        ("queue_depth", "gauge", "Requests waiting to be admitted.",
+         lambda route_class: [({}, len(route_class.waiters))]),
+        ("admitted_total", "counter", "Requests admitted.",
+         lambda route_class: [({}, route_class.admitted)]),
+        ("shed_total", "counter", "Requests rejected with a 503, by reason.",
+         lambda route_class: [({"reason": reason}, count)
+                              for reason, count in route_class.shed.items()]),
+        ("queue_wait_seconds_total", "counter", "Time spent by requests waiting to be admitted.",
+         lambda route_class: [({}, round(route_class.wait_seconds, 6))]),
+    ]
+    lines = []
+    for name, metric_type, description, samples in metrics:
+        lines += [
+            "# HELP {}_{} {}".format(prefix, name, description),
+            "# TYPE {}_{} {}".format(prefix, name, metric_type),
+        ]
+        for route_class in route_classes:
+            for labels, value in samples(route_class):
+                labels = dict({"route_class": route_class.name}, **labels)
+                lines.append(
+                    "{}_{}{{{}}} {}".format(
+                        prefix,
+                        name,
+                        ",".join('{}="{}"'.format(key, label) for key, label in labels.items()),
+                        value,
+                    )
+                )
+    return "\n".join(lines) + "\n"
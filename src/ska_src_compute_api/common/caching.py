@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedCache:
+    """LRU cache whose entries expire after <ttl> seconds or when the cache is invalidated.
+
+    Invalidation bumps the cache version rather than clearing it, so that it is O(1); entries of an
+    older version are treated as missing and evicted lazily.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            version, expires, value = entry
+            if version != self.version or expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.version, time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+
+
+def make_etag(content):
+    """Get a strong ETag for the bytes <content>."""
+    return '"{}"'.format(hashlib.sha256(content).hexdigest()[:32])
+
+
+def etag_matches(if_none_match, etag):
+    """Check whether an If-None-Match header value matches <etag> (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,143 @@
+import gzip
+import re
+from collections import OrderedDict
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+
+def negotiate_encoding(accept_encoding):
+    """Choose a content encoding given an Accept-Encoding header value, <accept_encoding>.
+
+    Brotli is preferred over gzip when both are equally acceptable.
+
+    :return: "br", "gzip" or None (identity).
+    :rtype: str
+    """
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    wildcard = qualities.get("*", 0.0)
+    candidates = [
+        (qualities.get(coding, wildcard), -preference, coding)
+        for preference, coding in enumerate(["br", "gzip"])
+    ]
+    quality, _, coding = max(candidates)
+    return coding if quality > 0 else None
+
+
+def compress(body, encoding, gzip_level=6, brotli_quality=5):
+    """Compress <body> with <encoding> ("br" or "gzip")."""
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+class CompressionMiddleware:
+    """ASGI middleware applying negotiated gzip/brotli compression to selected paths.
+
+    Only responses on paths matching one of <paths> (regular expressions matched against the full
+    request path) and with a body of at least <minimum_size> bytes are compressed.
+
+    Responses on paths matching one of <cacheable_paths> are assumed not to change for the lifetime
+    of the process (e.g. documentation, openapi schemas and static files). Their compressed
+    variants are cached per (method, path, query, host, encoding) and subsequent requests are
+    answered from the cache without calling the application.
+    """
+
+    def __init__(
+        self,
+        app,
+        paths=(),
+        cacheable_paths=(),
+        minimum_size=1024,
+        gzip_level=6,
+        brotli_quality=5,
+        max_cache_entries=256,
+    ):
+        self.app = app
+        self.paths = [re.compile(path) for path in paths]
+        self.cacheable_paths = [re.compile(path) for path in cacheable_paths]
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.max_cache_entries = max_cache_entries
+        self.cache = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        cacheable = any(pattern.search(path) for pattern in self.cacheable_paths)
+        if not cacheable and not any(pattern.search(path) for pattern in self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(request_headers.get("accept-encoding"))
+        cache_key = (
+            scope["method"],
+            path,
+            scope.get("query_string", b""),
+            request_headers.get("host"),
+            scope.get("root_path"),
+            encoding,
+        )
+        if cacheable and cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            status, headers, body = self.cache[cache_key]
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start_message = None
+        body_parts = []
+
+        async def buffered_send(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body_parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(body_parts)
+            headers = MutableHeaders(raw=list(start_message["headers"]))
+            compressible = (
+                encoding is not None
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and start_message["status"] not in (204, 304)
+            )
+            if compressible:
+                body = compress(body, encoding, self.gzip_level, self.brotli_quality)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):  # the compressed body is not byte-identical
+                    headers["ETag"] = "W/" + etag
+            headers.add_vary_header("Accept-Encoding")
+            if cacheable and start_message["status"] == 200:
+                self.cache[cache_key] = (start_message["status"], headers.raw, body)
+                if len(self.cache) > self.max_cache_entries:
+                    self.cache.popitem(last=False)
+            await send({**start_message, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, buffered_send)
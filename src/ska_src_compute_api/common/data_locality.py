@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class _LocationTable:
+    """Immutable lookup tables built from a list of location entries.
+
+    - Host entries map a host and all of its subdomains to sites, e.g. "skao.int" matches
+      "webdav.data.skao.int".
+    - Prefix entries map a URL (or, without a scheme, a bare path) prefix to sites, matched on
+      whole path segments, e.g. "https://data.example.org/survey/" matches
+      "https://data.example.org/survey/file.fits" but not ".../surveys/file.fits". Bare path
+      prefixes match under any host, e.g. "/demo_city/" matches
+      "https://storage.example.org/demo_city/file.fits".
+
+    The longest matching prefix wins (a URL prefix over a bare path prefix of the same length),
+    otherwise the most specific matching host.
+    """
+
+    def __init__(self, entries):
+        self.hosts = {}
+        self.prefixes = {}
+        for entry in entries:
+            sites = frozenset(entry["sites"])
+            if "host" in entry:
+                self.hosts[entry["host"].lower().strip(".")] = sites
+            else:
+                host, segments = _split(entry["prefix"])
+                node = self.prefixes.setdefault(host, {})
+                for segment in segments:
+                    node = node.setdefault(segment, {})
+                node[None] = sites
+
+    def resolve(self, dataset):
+        host, segments = _split(dataset)
+        depth, sites = _match_prefix(self.prefixes.get(host), segments)
+        if host:
+            any_host_depth, any_host_sites = _match_prefix(self.prefixes.get(""), segments)
+            if any_host_depth > depth:
+                sites = any_host_sites
+        if sites is not None:
+            return sites
+        labels = host.split(".") if host else []
+        for i in range(len(labels)):
+            sites = self.hosts.get(".".join(labels[i:]))
+            if sites is not None:
+                return sites
+        return frozenset()
+
+
+def _match_prefix(node, segments):
+    """Get the number of <segments> matched by the longest prefix in the trie <node>, and its
+    sites (-1 and None if no prefix matches).
+    """
+    depth, sites = -1, None
+    if node is None:
+        return depth, sites
+    if None in node:
+        depth, sites = 0, node[None]
+    for i, segment in enumerate(segments):
+        node = node.get(segment)
+        if node is None:
+            break
+        if None in node:
+            depth, sites = i + 1, node[None]
+    return depth, sites
+
+
+def _split(url):
+    """Split <url> into its (lowercased) host and non-empty path segments."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").strip(".")
+    return host, [segment for segment in parts.path.split("/") if segment]
+
+
+class DataLocationIndex:
+    """Index resolving dataset URLs to the site(s) hosting them.
+
+    Entries are loaded from a JSON file of the form:
+
+        {
+          "locations": [
+            {"host": "skao.int", "sites": ["spsrc"]},
+            {"prefix": "https://webdav.example.org/survey/", "sites": ["site-a", "site-b"]},
+            {"prefix": "/demo_city/", "sites": ["spsrc"]}
+          ]
+        }
+
+    Lookups take time proportional to the length of the dataset URL, independently of the number
+    of entries. If a <path> is given, the file is checked for changes at most every
+    <reload_interval> seconds and reloaded if modified.
+    """
+
+    def __init__(self, entries=None, path=None, reload_interval=10):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.last_check = time.monotonic()
+        self.table = _LocationTable(entries or [])
+        if path:
+            self.reload()
+
+    @classmethod
+    def from_file(cls, path, default_entries=None, reload_interval=10):
+        """Get an index loaded from <path>, or holding <default_entries> if <path> is not set."""
+        if not path:
+            return cls(default_entries)
+        return cls(path=path, reload_interval=reload_interval)
+
+    def reload(self):
+        """(Re)load entries from the file."""
+        mtime = os.path.getmtime(self.path)
+        with open(self.path) as f:
+            table = _LocationTable(json.load(f).get("locations", []))
+        self.table, self.mtime = table, mtime
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self.last_check < self.reload_interval:
+            return
+        if not self.lock.acquire(blocking=False):  # another thread is already checking
+            return
+        try:
+            self.last_check = now
+            if os.path.getmtime(self.path) != self.mtime:
+                self.reload()
+        except (OSError, ValueError, KeyError):  # keep the current entries
+            pass
+        finally:
+            self.lock.release()
+
+    def resolve(self, dataset):
+        """Get the set of sites hosting <dataset> (empty if unknown)."""
+        if self.path:
+            self._reload_if_changed()
+        return self.table.resolve(dataset)
@@ -1,3 +1,4 @@
+import httpx
 import requests
 import traceback
 from functools import wraps
@@ -21,7 +22,39 @@ def handle_client_exceptions(func):
         except CustomException as e:
             raise Exception(message=e.message)
         except CustomHTTPException as e:
-            raise HTTPException(status_code=e.http_error_status, detail=e.message)
+            raise HTTPException(
+                status_code=e.http_error_status,
+                detail=e.message,
+                headers=getattr(e, "headers", None),
+            )
+        except Exception as e:
+            detail = "General error occurred: {}, traceback: {}".format(
+                repr(e), "".join(traceback.format_tb(e.__traceback__))
+            )
+            raise HTTPException(status_code=500, detail=detail)
+
+    return wrapper
+
+
+def handle_async_client_exceptions(func):
+    """Decorator to handle async (httpx) client exceptions."""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except httpx.HTTPStatusError as e:
+            status_code = e.response.status_code
+            detail = f"HTTP error occurred: {e}, response: {e.response.text}"
+            raise HTTPException(status_code=status_code, detail=detail)
+        except HTTPException as e:
+            raise e
+        except CustomHTTPException as e:
+            raise HTTPException(
+                status_code=e.http_error_status,
+                detail=e.message,
+                headers=getattr(e, "headers", None),
+            )
         except Exception as e:
             detail = "General error occurred: {}, traceback: {}".format(
                 repr(e), "".join(traceback.format_tb(e.__traceback__))
@@ -47,7 +80,11 @@ def handle_exceptions(func):
         except CustomException as e:
             raise Exception(message=e.message)
         except CustomHTTPException as e:
-            raise HTTPException(status_code=e.http_error_status, detail=e.message)
+            raise HTTPException(
+                status_code=e.http_error_status,
+                detail=e.message,
+                headers=getattr(e, "headers", None),
+            )
         except Exception as e:
             detail = "General error occurred: {}, traceback: {}".format(
                 repr(e), "".join(traceback.format_tb(e.__traceback__))
@@ -73,8 +110,67 @@ class CustomHTTPException(Exception):
     pass
 
 
+class InvalidIdentifier(CustomException):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidCursor(CustomHTTPException):
+    def __init__(self):
+        self.message = "Invalid pagination cursor."
+        self.http_error_status = status.HTTP_400_BAD_REQUEST
+        super().__init__(self.message)
+
+
 class PermissionDenied(CustomHTTPException):
     def __init__(self):
         self.message = "You do not have permission to access this resource."
         self.http_error_status = status.HTTP_403_FORBIDDEN
         super().__init__(self.message)
+
+
+class IdempotencyKeyInProgress(CustomHTTPException):
+    def __init__(self, retry_after):
+        self.message = "A request with this Idempotency-Key is still in progress."
+        self.http_error_status = status.HTTP_409_CONFLICT
+        self.headers = {"Retry-After": retry_after}
+        super().__init__(self.message)
+
+
+class IdempotencyKeyMismatch(CustomHTTPException):
+    def __init__(self):
+        self.message = "This Idempotency-Key has already been used with a different request."
+        self.http_error_status = status.HTTP_422_UNPROCESSABLE_ENTITY
+        super().__init__(self.message)
+
+
+class JobStatusContended(CustomHTTPException):
+    def __init__(self, retry_after="1"):
+        self.message = "The job status is being updated concurrently, please retry."
+        self.http_error_status = status.HTTP_503_SERVICE_UNAVAILABLE
+        self.headers = {"Retry-After": retry_after}
+        super().__init__(self.message)
+
+
+class InvalidCallbackURL(CustomHTTPException):
+    def __init__(self, reason):
+        self.message = "Invalid callback URL: {}.".format(reason)
+        self.http_error_status = status.HTTP_422_UNPROCESSABLE_ENTITY
+        super().__init__(self.message)
+
+
+class RateLimited(CustomHTTPException):
+    def __init__(self, retry_after):
+        self.message = "Too many requests, please retry later."
+        self.http_error_status = status.HTTP_429_TOO_MANY_REQUESTS
+        self.headers = {"Retry-After": retry_after}
+        super().__init__(self.message)
+
+
+class QuotaExceeded(CustomHTTPException):
+    def __init__(self, resource, limit, retry_after):
+        self.message = "Quota exceeded: at most {} {} allowed per user.".format(limit, resource)
+        self.http_error_status = status.HTTP_429_TOO_MANY_REQUESTS
+        self.headers = {"Retry-After": retry_after}
+        super().__init__(self.message)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from ska_src_compute_api.common.tracing import tracer
+
+# Query response codes (see README) in order of preference: available, available but without the
+# data, not bookable right now, not available and internal error.
+#
+RESPONSE_CODE_RANKS = {0: 0, 4: 1, 2: 2, 1: 3, 3: 4}
+
+# Response code reported for sites that could not be reached or gave an invalid reply.
+#
+INTERNAL_ERROR_RESPONSE_CODE = 3
+
+
+class Site:
+    """A compute site known to the broker.
+
+    <url> is the base url of the site's compute API (e.g. https://compute.example.org/api/v1) and
+    <data_locations> the data locations held at (or close to) the site.
+    """
+
+    def __init__(self, name, url, data_locations=None, timeout=None):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.data_locations = {location.lower() for location in data_locations or []}
+        self.timeout = timeout
+
+    @classmethod
+    def from_dict(cls, site):
+        return cls(
+            name=site["name"],
+            url=site["url"],
+            data_locations=site.get("data_locations"),
+            timeout=site.get("timeout"),
+        )
+
+    def holds(self, data_location):
+        return (data_location or "").lower() in self.data_locations
+
+
+class SiteRegistry:
+    """Registry of compute sites, loaded from a JSON file of the form:
+
+        {
+          "sites": [
+            {"name": "spsrc", "url": "https://...", "data_locations": ["SPSRC"], "timeout": 2}
+          ]
+        }
+    """
+
+    def __init__(self, sites=None):
+        self.sites = list(sites or [])
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            registry = json.load(f)
+        return cls([Site.from_dict(site) for site in registry.get("sites", [])])
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def __len__(self):
+        return len(self.sites)
+
+
+class FederationBroker:
+    """Fan out availability queries to all registered sites concurrently and rank the results.
+
+    Each site is given at most <timeout> seconds (or its own timeout) to answer. Site answers are
+    cached for <cache_ttl> seconds per query, so repeated queries for the same resources do not
+    reach the sites; failed or timed out queries are not cached.
+    """
+
+    def __init__(self, registry, timeout=2.0, cache_ttl=10.0, max_connections=100,
+                 max_cache_entries=10000):
+        self.registry = registry
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.max_cache_entries = max_cache_entries
+        self.cache = {}
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+        )
+
+    def _get_cached(self, site, query_key):
+        entry = self.cache.get((site.name, query_key))
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self.cache[(site.name, query_key)]
+            return None
+        return {**result, "cached": True}
+
+    def _set_cached(self, site, query_key, result):
+        now = time.monotonic()
+        if len(self.cache) >= self.max_cache_entries:
+            self.cache = {key: entry for key, entry in self.cache.items() if entry[0] >= now}
+            if len(self.cache) >= self.max_cache_entries:
+                self.cache.clear()
+        self.cache[(site.name, query_key)] = (now + self.cache_ttl, result)
+
+    async def _query_site(self, site, body, token):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = "Bearer {}".format(token)
+        response = await self.client.post(
+            "{}/query".format(site.url), content=body, headers=headers
+        )
+        response.raise_for_status()
+        reply = response.json()
+        return int(reply["response_code"]), str(reply.get("response_text", ""))
+
+    async def query_site(self, site, query_input, query_key, token=None):
+        """Query a single site, returning its (possibly cached) answer.
+
+        Failures are reported as internal errors rather than raised, so that one unreachable site
+        does not fail the whole query.
+        """
+        result = self._get_cached(site, query_key)
+        if result is not None:
+            return result
+        timeout = site.timeout or self.timeout
+        start = time.perf_counter()
+        with tracer.start_as_current_span("federation.query_site") as span:
+            span.set_attribute("site.name", site.name)
+            try:
+                response_code, response_text = await asyncio.wait_for(
+                    self._query_site(site, query_key, token), timeout
+                )
+            except asyncio.TimeoutError:
+                response_code, response_text = (
+                    INTERNAL_ERROR_RESPONSE_CODE,
+                    "Internal error. Site did not answer within {}s.".format(timeout),
+                )
+                failed = True
+            except httpx.HTTPStatusError as e:
+                response_code, response_text = (
+                    INTERNAL_ERROR_RESPONSE_CODE,
+                    "Internal error. Site returned HTTP {}.".format(e.response.status_code),
+                )
+                failed = True
+            except (httpx.HTTPError, KeyError, TypeError, ValueError) as e:
+                response_code, response_text = (
+                    INTERNAL_ERROR_RESPONSE_CODE,
+                    "Internal error. Could not query site: {}".format(repr(e)),
+                )
+                failed = True
+            else:
+                failed = False
+            span.set_attribute("site.response_code", response_code)
+        result = {
+            "site": site.name,
+            "response_code": response_code,
+            "response_text": response_text,
+            "data_local": site.holds(query_input.data_location),
+            "cached": False,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+        if not failed:
+            self._set_cached(site, query_key, result)
+        return result
+
+    async def query(self, query_input, token=None):
+        """Query all sites for <query_input>, returning their answers best first.
+
+        Answers are ranked by availability (see RESPONSE_CODE_RANKS), then by data locality (sites
+        holding the requested data location first), then by latency.
+        """
+        query_key = query_input.json(sort_keys=True)
+        results = await asyncio.gather(
+            *[self.query_site(site, query_input, query_key, token) for site in self.registry]
+        )
+        return sorted(
+            results,
+            key=lambda result: (
+                RESPONSE_CODE_RANKS.get(result["response_code"], len(RESPONSE_CODE_RANKS)),
+                not result["data_local"],
+                result["latency_ms"],
+            ),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
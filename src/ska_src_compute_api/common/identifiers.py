@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import string
+
+from ska_src_compute_api.common.exceptions import InvalidIdentifier
+
+PROVISION = "prov"
+JOB = "job"
+_KIND_NAMES = {PROVISION: "provision", JOB: "job"}
+
+_BASE36_DIGITS = string.digits + string.ascii_lowercase
+_BASE36_CHARACTERS = frozenset(_BASE36_DIGITS)
+_DECIMAL_CHARACTERS = frozenset(string.digits)
+_SIGNATURE_CHARACTERS = frozenset(string.ascii_lowercase + "234567")
+
+# Longest identifier accepted by decode(), checked before any other parsing.
+#
+MAX_IDENTIFIER_LENGTH = 256
+
+
+def _to_base36(number):
+    digits = []
+    while True:
+        number, remainder = divmod(number, 36)
+        digits.append(_BASE36_DIGITS[remainder])
+        if not number:
+            return "".join(reversed(digits))
+
+
+class IdentifierCodec:
+    """Encode and decode the (site, numeric database id) pairs behind provision and job ids.
+
+    Without a <key>, ids take the form "<site>-<id>.<kind>" (e.g. "spsrc-12.prov"). With a <key>,
+    the id is written in base 36 and followed by a truncated HMAC of the site, kind and id (e.g.
+    "spsrc-c.n2hxk5qfmbvrs.prov"), so that valid ids cannot be guessed or enumerated.
+
+    Decoding is a fixed sequence of string operations (no regular expressions or backtracking)
+    with the signature compared in constant time. Invalid ids raise InvalidIdentifier.
+    """
+
+    def __init__(self, site, key=None, signature_length=8):
+        self.site = site
+        self.key = key.encode() if isinstance(key, str) else key
+        self.signature_length = signature_length
+        self._mac = hmac.new(self.key, digestmod=hashlib.sha256) if self.key is not None else None
+
+    def _sign(self, kind, number):
+        mac = self._mac.copy()  # cheaper than re-keying for every id
+        mac.update("{}-{}-{}".format(self.site, kind, number).encode())
+        return base64.b32encode(mac.digest()[: self.signature_length]).decode().rstrip("=").lower()
+
+    def encode(self, number, kind=PROVISION):
+        """Get the id of the <kind> ("prov" or "job") with numeric id <number>."""
+        if self.key is None:
+            return "{}-{}.{}".format(self.site, number, kind)
+        return "{}-{}.{}.{}".format(self.site, _to_base36(number), self._sign(kind, number), kind)
+
+    def decode(self, identifier, kind=PROVISION):
+        """Get the numeric id of the <kind> ("prov" or "job") with id <identifier>."""
+        kind_name = _KIND_NAMES.get(kind, kind)
+        if not isinstance(identifier, str) or len(identifier) > MAX_IDENTIFIER_LENGTH:
+            raise InvalidIdentifier("Invalid {} id format.".format(kind_name))
+        identifier, _, identifier_kind = identifier.rpartition(".")
+        site, _, body = identifier.rpartition("-")
+        if identifier_kind != kind or not site or not body:
+            raise InvalidIdentifier("Invalid {} id format.".format(kind_name))
+        if site != self.site:
+            raise InvalidIdentifier("Id belongs to another site.")
+        if self.key is None:
+            if not _DECIMAL_CHARACTERS.issuperset(body):
+                raise InvalidIdentifier("Invalid {} id format.".format(kind_name))
+            return int(body)
+        encoded_number, _, signature = body.partition(".")
+        if (
+            not encoded_number
+            or not _BASE36_CHARACTERS.issuperset(encoded_number)
+            or not _SIGNATURE_CHARACTERS.issuperset(signature)
+        ):
+            raise InvalidIdentifier("Invalid {} id format.".format(kind_name))
+        number = int(encoded_number, 36)
+        if not hmac.compare_digest(signature, self._sign(kind, number)):
+            raise InvalidIdentifier("Invalid {} id signature.".format(kind_name))
+        return number
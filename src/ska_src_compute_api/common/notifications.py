@@ -0,0 +1,392 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import smtplib
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from urllib.parse import urlsplit
+
+import httpcore
+import httpx
+from httpcore.backends.auto import AutoBackend
+from httpcore.backends.base import AsyncNetworkBackend
+from starlette.concurrency import run_in_threadpool
+
+from ska_src_compute_api.common.exceptions import InvalidCallbackURL
+from ska_src_compute_api.common.request_logging import logger
+from ska_src_compute_api.database import crud
+
+
+def _retry_delay(attempts, backoff, max_backoff):
+    return timedelta(seconds=min(backoff * 2 ** (attempts - 1), max_backoff))
+
+
+def _group_by_job(notifications):
+    """Group notifications by (destination, job), keeping their order."""
+    groups = OrderedDict()
+    for notification in notifications:
+        groups.setdefault((notification.destination, notification.job), []).append(notification)
+    return list(groups.values())
+
+
+def compose_email(sender, recipient, events):
+    """Compose a single email for one or more state changes (payloads, oldest first) of a job."""
+    latest = events[-1]
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = recipient
+    message["Subject"] = "Job {}: {}".format(latest["job_id"], latest["response_text"])
+    lines = [
+        "Job {} (provision {}) changed state:".format(latest["job_id"], latest["provision_id"]),
+        "",
+    ]
+    for event in events:
+        lines.append("{}  {}".format(event["time"], event["response_text"]))
+    if latest.get("output_data"):
+        lines += ["", "Output: {}".format(latest["output_data"])]
+    message.set_content("\n".join(lines) + "\n")
+    return message
+
+
+class SMTPSender:
+    """Deliver notifications as email through an SMTP server."""
+
+    def __init__(self, host, port=25, sender="compute-api@localhost", username=None,
+                 password=None, starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def deliver(self, recipient, events):
+        message = compose_email(self.sender, recipient, events)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+class LogSender:
+    """Log notifications instead of delivering them (when no SMTP server is configured)."""
+
+    def __init__(self, sender="compute-api@localhost"):
+        self.sender = sender
+
+    def deliver(self, recipient, events):
+        message = compose_email(self.sender, recipient, events)
+        logger.info(
+            "notification not delivered (no SMTP server configured)",
+            extra={
+                "event": "notification",
+                "recipient": recipient,
+                "subject": message["Subject"],
+            },
+        )
+
+
+class OutboxDispatcher:
+    """Deliver the pending notifications of an outbox channel.
+
+    Each call of dispatch_once() claims a batch of up to <batch_size> due notifications, coalesces
+    those for the same destination and job into a single delivery and makes the deliveries on a
+    pool of <workers> threads. Failed deliveries are retried with exponential backoff (starting at
+    <backoff> seconds, capped at <max_backoff>) until they have failed <max_attempts> times.
+    """
+
+    def __init__(self, session_factory, sender, channel="email", batch_size=100, workers=4,
+                 max_attempts=5, backoff=30, max_backoff=3600, lease=300):
+        self.session_factory = session_factory
+        self.sender = sender
+        self.channel = channel
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = timedelta(seconds=lease)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="{}-dispatcher".format(channel)
+        )
+
+    def dispatch_once(self):
+        """Deliver a batch of notifications, returning the number of notifications claimed."""
+        db = self.session_factory()
+        try:
+            notifications = crud.claim_notifications(
+                db, self.channel, uuid.uuid4().hex, self.lease, self.batch_size
+            )
+            futures = [
+                (
+                    group,
+                    self.executor.submit(
+                        self.sender.deliver,
+                        group[0].destination,
+                        [json.loads(notification.payload) for notification in group],
+                    ),
+                )
+                for group in _group_by_job(notifications)
+            ]
+            sent = []
+            for group, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    attempts = max(notification.attempts for notification in group) + 1
+                    logger.warning(
+                        "notification delivery failed",
+                        extra={
+                            "event": "notification",
+                            "channel": self.channel,
+                            "job": group[0].job,
+                            "attempts": attempts,
+                            "error": repr(e),
+                        },
+                    )
+                    crud.reschedule_notifications(
+                        db,
+                        [notification.id for notification in group],
+                        repr(e),
+                        datetime.now() + _retry_delay(attempts, self.backoff, self.max_backoff),
+                        self.max_attempts,
+                    )
+                else:
+                    sent += [notification.id for notification in group]
+            if sent:
+                crud.mark_notifications_sent(db, sent)
+            return len(notifications)
+        finally:
+            db.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class WebhookURLPolicy:
+    """Policy for the URLs webhooks may be sent to, guarding against server-side request forgery.
+
+    A URL must be http(s) and, if <allowed_hosts> is set, its host must be one of them or one of
+    their subdomains. Unless <allow_private>, every address its host resolves to must be public,
+    i.e. not loopback, link-local (e.g. cloud metadata services), private, reserved or multicast.
+    """
+
+    def __init__(self, allowed_hosts=None, allow_private=False):
+        self.allowed_hosts = [host.lower().strip(".") for host in allowed_hosts or []]
+        self.allow_private = allow_private
+
+    def check_url(self, url):
+        """Check the scheme and host of <url>, returning its (host, port)."""
+        parts = urlsplit(str(url))
+        host = (parts.hostname or "").strip(".")
+        if parts.scheme not in ("http", "https") or not host:
+            raise InvalidCallbackURL("not an http(s) URL")
+        if self.allowed_hosts and not any(
+            host == allowed or host.endswith("." + allowed) for allowed in self.allowed_hosts
+        ):
+            raise InvalidCallbackURL("host {} is not allowed".format(host))
+        return host, parts.port or (443 if parts.scheme == "https" else 80)
+
+    async def resolve(self, host, port):
+        """Resolve <host>, returning its addresses if they are all allowed."""
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+        except (socket.gaierror, ValueError):
+            raise InvalidCallbackURL("host {} cannot be resolved".format(host))
+        addresses = list(dict.fromkeys(sockaddr[0].split("%")[0] for *_, sockaddr in addresses))
+        if not self.allow_private:
+            for address in map(ipaddress.ip_address, addresses):
+                if not address.is_global or address.is_multicast:
+                    raise InvalidCallbackURL("host {} has a non-public address".format(host))
+        return addresses
+
+    async def check(self, url):
+        """Check <url>, raising InvalidCallbackURL if webhooks must not be sent to it."""
+        host, port = self.check_url(url)
+        if not self.allow_private:
+            await self.resolve(host, port)
+
+
+class _PolicyNetworkBackend(AsyncNetworkBackend):
+    """httpcore network backend connecting only to addresses allowed by a WebhookURLPolicy.
+
+    Hosts are resolved (and checked) when connecting, and the connection is made to the checked
+    address, so that a host cannot pass the check and then resolve elsewhere (DNS rebinding). TLS
+    still uses the host name, for SNI and certificate verification.
+    """
+
+    def __init__(self, url_policy):
+        self.url_policy = url_policy
+        self.backend = AutoBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None):
+        error = None
+        for address in await self.url_policy.resolve(host, port):
+            try:
+                return await self.backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None):
+        raise httpcore.ConnectError("unix sockets are not allowed")
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+class _PolicyTransport(httpx.AsyncHTTPTransport):
+    """httpx transport connecting through a _PolicyNetworkBackend."""
+
+    def __init__(self, url_policy, limits):
+        super().__init__(limits=limits)
+        # httpx does not expose the network backend of its connection pool, so replace the pool
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=_PolicyNetworkBackend(url_policy),
+        )
+
+
+class WebhookDispatcher:
+    """Deliver the pending notifications of the webhook outbox channel.
+
+    Each notification is POSTed as JSON to its destination (the job's callback URL) with a pooled
+    async HTTP client. Each call of dispatch_once() claims a batch of up to <batch_size> due
+    notifications; those of a job are delivered in order, one at a time, while different jobs are
+    delivered concurrently, with at most <per_host_limit> requests in flight per host. Any
+    response other than a 2xx is a failure, retried as for OutboxDispatcher. If a <url_policy> is
+    set, each destination is checked against it (again) before every delivery, and connections
+    are only made to the addresses it allows.
+
+    If a <key> is set, payloads are signed: the X-Signature header holds
+    "sha256=<hex HMAC-SHA256 of '<timestamp>.<body>'>", with the (unix) timestamp in
+    X-Signature-Timestamp, so that receivers can check where notifications come from and reject
+    replays.
+    """
+
+    def __init__(self, session_factory, key=None, batch_size=100, per_host_limit=4,
+                 max_connections=100, timeout=10, max_attempts=5, backoff=30, max_backoff=3600,
+                 lease=300, url_policy=None):
+        self.session_factory = session_factory
+        self.key = key.encode() if isinstance(key, str) else key
+        self.url_policy = url_policy
+        self.batch_size = batch_size
+        self.per_host_limit = per_host_limit
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = timedelta(seconds=lease)
+        self.host_limits = {}  # host: [semaphore, number of deliveries using it]
+        limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=limits,
+            transport=_PolicyTransport(url_policy, limits) if url_policy is not None else None,
+            headers={"User-Agent": "ska-src-compute-api"},
+        )
+
+    def sign(self, timestamp, body):
+        return "sha256=" + hmac.new(
+            self.key, timestamp.encode() + b"." + body, hashlib.sha256
+        ).hexdigest()
+
+    async def post(self, url, body):
+        if self.url_policy is not None:
+            self.url_policy.check_url(url)  # addresses are checked when connecting
+        headers = {"Content-Type": "application/json"}
+        if self.key is not None:
+            timestamp = str(int(time.time()))
+            headers["X-Signature-Timestamp"] = timestamp
+            headers["X-Signature"] = self.sign(timestamp, body)
+        host = urlsplit(url).netloc
+        # semaphores are dropped once no delivery uses them, so that hosts do not accumulate
+        host_limit = self.host_limits.setdefault(
+            host, [asyncio.Semaphore(self.per_host_limit), 0]
+        )
+        host_limit[1] += 1
+        try:
+            async with host_limit[0]:
+                response = await self.client.post(url, content=body, headers=headers)
+        finally:
+            host_limit[1] -= 1
+            if not host_limit[1]:
+                del self.host_limits[host]
+        response.raise_for_status()
+
+    async def deliver(self, group):
+        """Deliver a job's notifications in order, returning those delivered, those not
+        delivered (from the first failure on) and the error.
+        """
+        for i, notification in enumerate(group):
+            try:
+                await self.post(notification.destination, notification.payload.encode())
+            except Exception as e:
+                return group[:i], group[i:], e
+        return group, [], None
+
+    async def dispatch_once(self):
+        """Deliver a batch of notifications, returning the number of notifications claimed."""
+        db = self.session_factory()
+        try:
+            notifications = await run_in_threadpool(
+                crud.claim_notifications,
+                db,
+                "webhook",
+                uuid.uuid4().hex,
+                self.lease,
+                self.batch_size,
+            )
+            results = await asyncio.gather(
+                *[self.deliver(group) for group in _group_by_job(notifications)]
+            )
+            sent = [
+                notification.id for delivered, _, _ in results for notification in delivered
+            ]
+            if sent:
+                await run_in_threadpool(crud.mark_notifications_sent, db, sent)
+            for _, failed, error in results:
+                if not failed:
+                    continue
+                attempts = failed[0].attempts + 1
+                logger.warning(
+                    "notification delivery failed",
+                    extra={
+                        "event": "notification",
+                        "channel": "webhook",
+                        "job": failed[0].job,
+                        "attempts": attempts,
+                        "error": repr(error),
+                    },
+                )
+                await run_in_threadpool(
+                    crud.reschedule_notifications,
+                    db,
+                    [notification.id for notification in failed],
+                    repr(error),
+                    datetime.now() + _retry_delay(attempts, self.backoff, self.max_backoff),
+                    self.max_attempts,
+                )
+            return len(notifications)
+        finally:
+            db.close()
+
+    async def aclose(self):
+        await self.client.aclose()
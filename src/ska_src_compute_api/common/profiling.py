@@ -0,0 +1,104 @@
+import hmac
+import os
+import re
+import time
+import uuid
+
+from pyinstrument import Profiler
+from pyinstrument.renderers import SpeedscopeRenderer
+from starlette.datastructures import Headers, MutableHeaders
+
+from ska_src_compute_api.common.request_logging import logger
+
+PROFILE_REQUEST_HEADER = "x-profile"
+PROFILE_RESPONSE_HEADER = "X-Profile-Id"
+
+
+class RequestProfiler:
+    """Opt-in sampling profiler for single requests.
+
+    A request is profiled either if it carries an X-Profile header matching the configured <token>,
+    or if profiling has been armed (via arm()) for the next request to a path matching a pattern.
+    Only one request is profiled at a time. Profiles are written in speedscope (flame graph) JSON
+    format to <output_dir> and their ids returned in the X-Profile-Id response header.
+    """
+
+    def __init__(self, output_dir, token=None, interval=0.001):
+        self.output_dir = output_dir
+        self.token = token
+        self.interval = interval
+        self.armed_pattern = None
+        self.busy = False
+
+    def arm(self, path_pattern=".*"):
+        """Profile the next request with a path matching the regular expression <path_pattern>."""
+        self.armed_pattern = re.compile(path_pattern)
+
+    def get_profile_path(self, profile_id):
+        """Get the path of a stored profile, or None if it does not exist."""
+        if not re.fullmatch(r"[0-9a-f]{32}", profile_id or ""):
+            return None
+        path = os.path.join(self.output_dir, "{}.speedscope.json".format(profile_id))
+        return path if os.path.exists(path) else None
+
+    def should_profile(self, scope):
+        if self.busy:
+            return False
+        if self.token:
+            header = Headers(scope=scope).get(PROFILE_REQUEST_HEADER)
+            if header and hmac.compare_digest(header, self.token):
+                return True
+        armed_pattern = self.armed_pattern
+        if armed_pattern is not None and armed_pattern.search(scope["path"]):
+            self.armed_pattern = None
+            return True
+        return False
+
+    async def profile(self, app, scope, receive, send):
+        """Run <app> for this request under the profiler, saving the profile."""
+        profile_id = uuid.uuid4().hex
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=list(message["headers"]))
+                headers[PROFILE_RESPONSE_HEADER] = profile_id
+                message = {**message, "headers": headers.raw}
+            await send(message)
+
+        self.busy = True
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await app(scope, receive, profiled_send)
+        finally:
+            profiler.stop()
+            self.busy = False
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, "{}.speedscope.json".format(profile_id))
+            with open(path, "w") as f:
+                f.write(profiler.output(renderer=SpeedscopeRenderer()))
+            logger.info(
+                "request profiled",
+                extra={
+                    "event": "profile",
+                    "profile_id": profile_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                },
+            )
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests selected by a RequestProfiler."""
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        await self.profiler.profile(self.app, scope, receive, send)
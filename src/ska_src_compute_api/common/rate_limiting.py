@@ -0,0 +1,112 @@
+import math
+import threading
+import time
+
+import redis.asyncio
+
+
+class InMemoryRateLimiter:
+    """Per-process token bucket rate limiter.
+
+    Each key (e.g. user and route) has a bucket holding up to <burst> tokens, refilled at <rate>
+    tokens per second. Each request takes one token.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    async def acquire(self, key):
+        """Take a token for <key>.
+
+        :return: 0 if the request is allowed, else the number of seconds until it would be.
+        :rtype: float
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+        return retry_after
+
+    def _prune(self, now):
+        """Drop buckets that would have refilled completely (i.e. idle keys)."""
+        refill_time = self.burst / self.rate
+        self.buckets = {
+            key: (tokens, last)
+            for key, (tokens, last) in self.buckets.items()
+            if now - last < refill_time
+        }
+
+
+class RedisRateLimiter:
+    """Token bucket rate limiter shared between workers/replicas via redis.
+
+    Buckets are updated atomically server-side (using redis' clock) and expire once idle. The
+    redis client is asynchronous, so that waiting for redis does not block the event loop.
+    """
+
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+        local tokens = tonumber(state[1]) or burst
+        local last = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+        local retry_after = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            retry_after = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(retry_after)
+    """
+
+    def __init__(self, rate, burst, url, prefix="compute-api:rate-limit:"):
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    async def acquire(self, key):
+        """Take a token for <key>.
+
+        :return: 0 if the request is allowed, else the number of seconds until it would be.
+        :rtype: float
+        """
+        return float(await self.script(keys=[self.prefix + key], args=[self.rate, self.burst]))
+
+
+def get_rate_limiter(backend, rate, burst, redis_url=None):
+    """Get a rate limiter for <backend> ("memory" or "redis"), or None if rate limiting is off."""
+    if not backend or backend == "none":
+        return None
+    if not rate > 0:
+        raise ValueError("The rate limit rate must be positive, got: {}".format(rate))
+    if not burst >= 1:
+        raise ValueError("The rate limit burst must be at least 1, got: {}".format(burst))
+    if backend == "memory":
+        return InMemoryRateLimiter(rate, burst)
+    if backend == "redis":
+        return RedisRateLimiter(rate, burst, redis_url)
+    raise ValueError("Unknown rate limit backend: {}".format(backend))
+
+
+def format_retry_after(seconds):
+    """Format a Retry-After header value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,54 @@
+import math
+import time
+
+# Key of the request state flag marking requests that wrote to the primary database.
+#
+WROTE = "wrote_to_primary"
+
+
+def mark_write(request):
+    """Mark <request> as having written to the primary database."""
+    setattr(request.state, WROTE, True)
+
+
+def wrote_recently(request, cookie_name):
+    """Check whether the client of <request> carries a read-your-writes window still open."""
+    try:
+        return float(request.cookies.get(cookie_name, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware carrying a client's read-your-writes window in a cookie.
+
+    Responses to requests marked with mark_write() set a <cookie_name> cookie holding the (unix)
+    time until which, <window> seconds from now, the client's reads should go to the primary
+    database (see wrote_recently). As the window travels with the client, it holds whichever
+    worker or replica serves its next request.
+    """
+
+    def __init__(self, app, window, cookie_name):
+        self.app = app
+        self.window = window
+        self.cookie_name = cookie_name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.window:
+            await self.app(scope, receive, send)
+            return
+        # created here so that it is shared with any copies of the scope made downstream
+        state = scope.setdefault("state", {})
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and state.get(WROTE):
+                cookie = "{}={:.3f}; Max-Age={}; Path=/; HttpOnly; SameSite=Strict".format(
+                    self.cookie_name, time.time() + self.window, math.ceil(self.window)
+                )
+                message = dict(
+                    message,
+                    headers=list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())],
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
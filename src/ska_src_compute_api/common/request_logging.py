@@ -0,0 +1,119 @@
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+from opentelemetry import trace
+from sqlalchemy import event
+
+logger = logging.getLogger("ska_src_compute_api")
+
+# Attributes present on every LogRecord, i.e. anything else was passed via extra=.
+#
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects, including any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level="INFO"):
+    """Send the service's logs to stderr as JSON lines."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter())
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def get_trace_id():
+    """Get the current trace id as a hex string, or None if there is no active trace."""
+    span_context = trace.get_current_span().get_span_context()
+    if not span_context.is_valid:
+        return None
+    return format(span_context.trace_id, "032x")
+
+
+def instrument_slow_queries(engine, threshold_ms):
+    """Log SQL statements executed by <engine> that take longer than <threshold_ms>.
+
+    Statement parameters are not logged as they may contain user data.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start_time = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - context._query_start_time) * 1000
+        if duration_ms >= threshold_ms:
+            logger.warning(
+                "slow query",
+                extra={
+                    "event": "slow_query",
+                    "statement": statement,
+                    "executemany": executemany,
+                    "duration_ms": round(duration_ms, 3),
+                    "trace_id": get_trace_id(),
+                },
+            )
+
+
+class RequestLoggingMiddleware:
+    """ASGI middleware logging one structured entry per HTTP request, with timing.
+
+    Requests taking longer than <slow_request_threshold_ms> are logged at WARNING level.
+    """
+
+    def __init__(self, app, slow_request_threshold_ms=1000):
+        self.app = app
+        self.slow_request_threshold_ms = slow_request_threshold_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def logged_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, logged_send)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            route = scope.get("route")
+            slow = duration_ms >= self.slow_request_threshold_ms
+            logger.log(
+                logging.WARNING if slow else logging.INFO,
+                "slow request" if slow else "request",
+                extra={
+                    "event": "slow_request" if slow else "request",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(route, "path", None),
+                    "status_code": status_code,
+                    "duration_ms": round(duration_ms, 3),
+                    "client": (scope.get("client") or [None])[0],
+                    "trace_id": get_trace_id(),
+                },
+            )
@@ -0,0 +1,133 @@
+import threading
+
+from opentelemetry import trace
+from opentelemetry.propagate import extract
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind
+from sqlalchemy import event
+
+# Tracer for the service. This is a proxy until configure_tracing() sets a provider, so spans are
+# no-ops when tracing is disabled.
+#
+tracer = trace.get_tracer("ska_src_compute_api")
+
+
+class JSONLinesSpanExporter(SpanExporter):
+    """Span exporter writing one JSON (OpenTelemetry span) object per line to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self.lock, open(self.path, "a") as f:
+            f.write(lines)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def configure_tracing(
+    service_name, exporter=None, otlp_endpoint=None, jsonl_path=None, sample_rate=1.0
+):
+    """Configure the global tracer provider.
+
+    :param str service_name: The service name resource attribute.
+    :param str exporter: The exporter, either "otlp" or "jsonl". If None, tracing is disabled.
+    :param str otlp_endpoint: The OTLP/HTTP traces endpoint (default: the exporter's default).
+    :param str jsonl_path: The file to write spans to for the "jsonl" exporter.
+    :param float sample_rate: The fraction of (root) requests to trace.
+    """
+    if not exporter:
+        return
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        span_exporter = OTLPSpanExporter(endpoint=otlp_endpoint)
+    elif exporter == "jsonl":
+        span_exporter = JSONLinesSpanExporter(jsonl_path)
+    else:
+        raise ValueError("Unknown tracing exporter: {}".format(exporter))
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(sample_rate)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+
+
+def instrument_engine(engine):
+    """Add a child span around each SQL statement executed by <engine>."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = tracer.start_span("db.statement", kind=SpanKind.CLIENT)
+        if span.is_recording():
+            span.set_attribute("db.system", engine.dialect.name)
+            span.set_attribute("db.statement", statement)
+        context._tracing_span = span
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_tracing_span", None)
+        if span is not None:
+            span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        span = getattr(exception_context.execution_context, "_tracing_span", None)
+        if span is not None:
+            span.record_exception(exception_context.original_exception)
+            span.set_status(trace.Status(trace.StatusCode.ERROR))
+            span.end()
+
+
+class TracingMiddleware:
+    """ASGI middleware creating a root (server) span per HTTP request.
+
+    Incoming W3C trace context headers are honoured so spans join any caller's trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        with tracer.start_as_current_span(
+            "{} {}".format(scope["method"], scope["path"]),
+            context=extract(headers),
+            kind=SpanKind.SERVER,
+        ) as span:
+            if not span.is_recording():
+                await self.app(scope, receive, send)
+                return
+            span.set_attribute("http.method", scope["method"])
+            span.set_attribute("http.target", scope["path"])
+
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(trace.Status(trace.StatusCode.ERROR))
+                await send(message)
+
+            await self.app(scope, receive, traced_send)
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                span.update_name("{} {}".format(scope["method"], route.path))
+                span.set_attribute("http.route", route.path)
@@ -0,0 +1,45 @@
+import asyncio
+import fcntl
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class RootPathUvicornWorker(UvicornWorker):
+    """Uvicorn worker for gunicorn serving the app under API_ROOT_PATH (as uvicorn --root-path)."""
+
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "root_path": os.environ.get("API_ROOT_PATH", ""),
+    }
+
+
+class BackgroundTaskLock:
+    """Lock electing one of the processes sharing the lock file at <path> (e.g. the workers of a
+    gunicorn server) to run background tasks, so that they do not run once per worker.
+
+    The lock is released when the process holding it exits, after which another process can take
+    it over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        """Try to take the lock without blocking, returning whether this process holds it."""
+        if self.file is not None:
+            return True
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.file = lock_file
+        return True
+
+    async def wait(self, interval):
+        """Wait until this process holds the lock, trying every <interval> seconds."""
+        while not self.acquire():
+            await asyncio.sleep(interval)
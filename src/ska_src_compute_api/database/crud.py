@@ -1,9 +1,31 @@
+import json
+import random
+import time
+
+from sqlalchemy import (
+    and_,
+    case,
+    delete,
+    func,
+    insert,
+    literal,
+    not_,
+    or_,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, Union
+from typing import Optional, Dict, List, Tuple, Union
 import ska_src_compute_api.database.models as db_models
+from ska_src_compute_api.common.data_locality import DataLocationIndex
+from ska_src_compute_api.common.exceptions import InvalidIdentifier, JobStatusContended
+from ska_src_compute_api.common.request_logging import logger
+from ska_src_compute_api.common.identifiers import IdentifierCodec, JOB, PROVISION
 from datetime import datetime, timedelta
 from ska_src_compute_api import models as api_models
-import re
 
 
 def add_provision(
@@ -39,42 +61,43 @@ def check_provision_validity(
     return datetime.now() <= provision.validity
 
 
-def parse_provision_id(provision_id: str) -> Union[Dict[str, Union[str, int]], int]:
-    try:
-        prov_id = re.match(".*-(\d+).prov", provision_id).group(1)
-    except AttributeError:
-        return {
-            "response_code": 2,
-            "response_text": "Invalid provision: Provision format is invalid.",
-            "job_id": None,
-        }
-    return prov_id
-
-
 def add_job(
     db: Session,
     job_data: api_models.JobInput,
     provision_id: str,
     data_centre: str,
     user_id: str,
+    data_locations: DataLocationIndex,
+    ids: IdentifierCodec,
 ) -> Dict[str, Union[str, int]]:
-    prov_id = parse_provision_id(provision_id)
-    provision = get_provision(prov_id, db)
-    provcheck = check_provision_validity(provision, db)
-    if provision.user_id != user_id:
-        return {"response_code": 4, "response_text": "Access denied", "job_id": None}
-    if not any(value in job_data.dataset for value in ["/demo_city/", "skao.int", "iaa.csic.es"]):
+    try:
+        prov_id = ids.decode(provision_id, PROVISION)
+    except InvalidIdentifier as e:
         return {
-            "response_code": 1,
-            "response_text": "Job cannot be executed: Data not in this location",
+            "response_code": 2,
+            "response_text": "Invalid provision: {}".format(e.message),
             "job_id": None,
         }
-    if provcheck is None:
+    provision = get_provision(prov_id, db)
+    if provision is None:
         return {
             "response_code": 2,
             "response_text": "Invalid provision: Provision ID unknown.",
             "job_id": None,
         }
+    provcheck = check_provision_validity(provision, db)
+    if provision.user_id != user_id:
+        return {"response_code": 4, "response_text": "Access denied", "job_id": None}
+    dataset_sites = data_locations.resolve(job_data.dataset)
+    if data_centre not in dataset_sites:
+        response_text = "Job cannot be executed: Data not in this location"
+        if dataset_sites:
+            response_text += " (available at: {})".format(", ".join(sorted(dataset_sites)))
+        return {
+            "response_code": 1,
+            "response_text": response_text,
+            "job_id": None,
+        }
     if not provcheck:
         return {
             "response_code": 2,
@@ -88,6 +111,7 @@ def add_job(
         params=job_data.params,
         dataset=job_data.dataset,
         contact_email=job_data.contact_email,
+        callback_url=job_data.callback_url,
     )
     db.add(job)
     db.commit()
@@ -100,8 +124,11 @@ def add_job(
         job_flow = "happy_flow"
     job_status = db_models.JobStatus(job=job.id, flow=job_flow, flow_stage=0)
     db.add(job_status)
+    job_id = ids.encode(job.id, JOB)
+    _add_job_notifications(
+        db, job, provision_id, job_id, {"response_code": 1, "response_text": "Submitted"}
+    )
     db.commit()
-    job_id = f"{data_centre}-{job.id}.job"
     return {"response_code": 1, "response_text": "Ok", "job_id": job_id}
 
 
@@ -160,28 +187,496 @@ flows = {
 }
 
 
+# Number of attempts to advance a job's stage when concurrent status requests contend for it, with
+# a random backoff of up to JOB_STATUS_UPDATE_BACKOFF * 2^attempt seconds between attempts. If all
+# attempts fail, the request is rejected (with a 503) rather than report a stage a second time.
+#
+JOB_STATUS_UPDATE_ATTEMPTS = 8
+JOB_STATUS_UPDATE_BACKOFF = 0.001
+
+
 def get_job_status(
-    db: Session, provision_id: str, user_id: str
-) -> Dict[str, Union[str, int]]:
-    prov_id = parse_provision_id(provision_id)
+    db: Session, provision_id: str, user_id: str, ids: IdentifierCodec
+) -> Tuple[Dict[str, Union[str, int]], Optional[Tuple[int, int, bool]]]:
+    """Get the status of the job for a provision.
+
+    Returns the status and, if a job was found, its (job id, stage, whether the stage is final).
+    """
+    try:
+        prov_id = ids.decode(provision_id, PROVISION)
+    except InvalidIdentifier as e:
+        return {"response_code": 2, "response_text": "Invalid job: {}".format(e.message)}, None
     job = db.query(db_models.Jobs).filter(db_models.Jobs.provision == prov_id).first()  # type: ignore
     if not job:
-        return {"response_code": 2, "response_text": "Invalid job: Job does not exist"}
+        return get_archived_job_status(db, prov_id, user_id)
     if job.user_id != user_id:
-        return {"response_code": 4, "response_text": "Access denied"}
-    job_status = (
-        db.query(db_models.JobStatus).filter(db_models.JobStatus.job == job.id).first()
+        return {"response_code": 4, "response_text": "Access denied"}, None
+    # Each request reports the current stage and advances the flow by one stage. The advance is a
+    # compare-and-swap on the stage read, so that concurrent requests neither lose advances nor
+    # skip stages; a request that loses the race re-reads the stage and tries again.
+    for attempt in range(JOB_STATUS_UPDATE_ATTEMPTS):
+        job_flow, flow_stage = db.execute(
+            select(db_models.JobStatus.flow, db_models.JobStatus.flow_stage).where(
+                db_models.JobStatus.job == job.id
+            )
+        ).one()
+        stage = min(flow_stage, len(flows[job_flow]) - 1)
+        state = flows[job_flow][stage]
+        if flow_stage >= len(flows[job_flow]):
+            break
+        advanced = db.execute(
+            update(db_models.JobStatus)
+            .where(
+                db_models.JobStatus.job == job.id,
+                db_models.JobStatus.flow_stage == flow_stage,
+            )
+            .values(flow_stage=db_models.JobStatus.flow_stage + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if advanced:
+            _add_job_notifications(
+                db,
+                job,
+                provision_id,
+                ids.encode(job.id, JOB),
+                {"response_code": state[0], "response_text": state[1], "output_data": state[3]},
+            )
+            db.commit()
+            break
+        db.rollback()
+        if attempt + 1 < JOB_STATUS_UPDATE_ATTEMPTS:
+            time.sleep(random.uniform(0, JOB_STATUS_UPDATE_BACKOFF * 2**attempt))
+    else:
+        logger.warning(
+            "job status contended",
+            extra={
+                "event": "job_status_contended",
+                "job_id": ids.encode(job.id, JOB),
+                "attempts": JOB_STATUS_UPDATE_ATTEMPTS,
+            },
+        )
+        raise JobStatusContended()
+
+    return (
+        dict(zip(["response_code", "response_text", "logging", "output_data"], state)),
+        (job.id, stage, stage == len(flows[job_flow]) - 1),
+    )
+
+
+def _add_job_notifications(
+    db: Session, job: db_models.Jobs, provision_id: str, job_id: str, state: Dict
+) -> None:
+    """Queue notifications of a job state change to the job's contact email and callback URL.
+
+    Notifications are only added to the session, so that they are committed (or rolled back) in
+    the same transaction as the state change.
+    """
+    now = datetime.now()
+    payload = json.dumps(
+        dict(state, job_id=job_id, provision_id=provision_id, time=now.isoformat())
     )
-    job_flow = job_status.flow
+    for channel, destination in (("email", job.contact_email), ("webhook", job.callback_url)):
+        if not destination:
+            continue
+        db.add(
+            db_models.Outbox(
+                job=job.id,
+                channel=channel,
+                destination=destination,
+                payload=payload,
+                created=now,
+                status="pending",
+                attempts=0,
+                next_attempt=now,
+            )
+        )
+
+
+def count_active_provisions(db: Session, user_id: str) -> Tuple[int, Optional[datetime]]:
+    """Count the user's unexpired provisions.
+
+    Returns the count and the time at which the first of them expires (None if there are none).
+    """
+    count, first_expiry = (
+        db.query(func.count(db_models.Provisions.id), func.min(db_models.Provisions.validity))
+        .filter(
+            db_models.Provisions.user_id == user_id,
+            db_models.Provisions.validity >= datetime.now(),
+        )
+        .one()
+    )
+    return count, first_expiry
+
+
+def get_archived_job_status(
+    db: Session, prov_id: int, user_id: str
+) -> Tuple[Dict[str, Union[str, int]], Optional[Tuple[int, int, bool]]]:
+    job = (
+        db.query(db_models.ArchivedJobs)
+        .filter(db_models.ArchivedJobs.provision == prov_id)
+        .first()
+    )
+    if not job:
+        return {"response_code": 2, "response_text": "Invalid job: Job does not exist"}, None
+    if job.user_id != user_id:
+        return {"response_code": 4, "response_text": "Access denied"}, None
+    return (
+        dict(
+            zip(["response_code", "response_text", "logging", "output_data"], flows[job.flow][-1])
+        ),
+        (job.job, len(flows[job.flow]) - 1, True),
+    )
+
+
+def _job_running():
+    """Filter for jobs that have not yet reached the final stage of their flow."""
+    return or_(
+        *[
+            and_(
+                db_models.JobStatus.flow == flow,
+                db_models.JobStatus.flow_stage < len(states),
+            )
+            for flow, states in flows.items()
+        ]
+    )
+
+
+def count_running_jobs(db: Session, user_id: str) -> int:
+    """Count the user's jobs that have not yet reached the final stage of their flow."""
+    return (
+        db.query(func.count(db_models.Jobs.id))
+        .join(db_models.JobStatus, db_models.JobStatus.job == db_models.Jobs.id)
+        .filter(db_models.Jobs.user_id == user_id, _job_running())
+        .scalar()
+    )
+
+
+def list_provisions(
+    db: Session,
+    user_id: str,
+    active: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[db_models.Provisions]:
+    """List the user's provisions, newest first, optionally filtered by state and validity.
+
+    Pagination is by keyset: pass the id of the last provision of a page as <before_id> to get the
+    next page.
+    """
+    query = db.query(db_models.Provisions).filter(db_models.Provisions.user_id == user_id)
+    if active is not None:
+        now = datetime.now()
+        query = query.filter(
+            db_models.Provisions.validity >= now
+            if active
+            else db_models.Provisions.validity < now
+        )
+    if since is not None:
+        query = query.filter(db_models.Provisions.validity >= since)
+    if until is not None:
+        query = query.filter(db_models.Provisions.validity < until)
+    if before_id is not None:
+        query = query.filter(db_models.Provisions.id < before_id)
+    return query.order_by(db_models.Provisions.id.desc()).limit(limit).all()
+
+
+def list_jobs(
+    db: Session,
+    user_id: str,
+    running: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[Row]:
+    """List the user's jobs, archived or not, with their status and provision validity, newest
+    first.
+
+    Rows have the job's job_id, provision, container, dataset, flow and flow_stage, and the
+    provision_validity. Jobs can be filtered by state (archived jobs are never running) and by the
+    validity of their provision. Pagination is by keyset: pass the id of the last job of a page as
+    <before_id> to get the next page.
+    """
+
+    def filtered(query, job_id):
+        if since is not None:
+            query = query.where(db_models.Provisions.validity >= since)
+        if until is not None:
+            query = query.where(db_models.Provisions.validity < until)
+        if before_id is not None:
+            query = query.where(job_id < before_id)
+        return query.order_by(job_id.desc()).limit(limit).subquery()
+
+    hot = (
+        select(
+            db_models.Jobs.id.label("job_id"),
+            db_models.Jobs.provision,
+            db_models.Jobs.container,
+            db_models.Jobs.dataset,
+            db_models.JobStatus.flow,
+            db_models.JobStatus.flow_stage,
+            db_models.Provisions.validity.label("provision_validity"),
+        )
+        .join(db_models.JobStatus, db_models.JobStatus.job == db_models.Jobs.id)
+        .join(db_models.Provisions, db_models.Provisions.id == db_models.Jobs.provision)
+        .where(db_models.Jobs.user_id == user_id)
+    )
+    if running is not None:
+        hot = hot.where(_job_running() if running else not_(_job_running()))
+    pages = [filtered(hot, db_models.Jobs.id)]
+    if not running:
+        archived = (
+            select(
+                db_models.ArchivedJobs.job.label("job_id"),
+                db_models.ArchivedJobs.provision,
+                db_models.ArchivedJobs.container,
+                db_models.ArchivedJobs.dataset,
+                db_models.ArchivedJobs.flow,
+                db_models.ArchivedJobs.flow_stage,
+                db_models.Provisions.validity.label("provision_validity"),
+            )
+            .join(db_models.Provisions, db_models.Provisions.id == db_models.ArchivedJobs.provision)
+            .where(db_models.ArchivedJobs.user_id == user_id)
+        )
+        pages.append(filtered(archived, db_models.ArchivedJobs.job))
+    # each table gives (at most) a page of its newest jobs, which are merged into one page
+    jobs = union_all(*[select(page) for page in pages]).subquery()
+    return db.execute(select(jobs).order_by(jobs.c.job_id.desc()).limit(limit)).all()
+
+
+def archive_completed_jobs(db: Session, older_than: timedelta, batch_size: int = 1000) -> int:
+    """Move completed jobs whose provisions expired more than <older_than> ago to the archive.
+
+    Jobs are copied to the archivedjobs table and deleted from the jobs and jobstatus tables in
+    batches of <batch_size>, one transaction per batch, so that the hot tables only hold recent
+    and running jobs. Returns the number of jobs archived.
+    """
+    cutoff = datetime.now() - older_than
+    archived = 0
+    while True:
+        job_ids = db.scalars(
+            select(db_models.Jobs.id)
+            .join(db_models.JobStatus, db_models.JobStatus.job == db_models.Jobs.id)
+            .join(db_models.Provisions, db_models.Provisions.id == db_models.Jobs.provision)
+            .where(db_models.Provisions.validity < cutoff, not_(_job_running()))
+            .limit(batch_size)
+        ).all()
+        if not job_ids:
+            return archived
+        try:
+            db.execute(
+                insert(db_models.ArchivedJobs).from_select(
+                    [
+                        "job",
+                        "user_id",
+                        "container",
+                        "params",
+                        "dataset",
+                        "contact_email",
+                        "callback_url",
+                        "provision",
+                        "flow",
+                        "flow_stage",
+                        "archived",
+                    ],
+                    select(
+                        db_models.Jobs.id,
+                        db_models.Jobs.user_id,
+                        db_models.Jobs.container,
+                        db_models.Jobs.params,
+                        db_models.Jobs.dataset,
+                        db_models.Jobs.contact_email,
+                        db_models.Jobs.callback_url,
+                        db_models.Jobs.provision,
+                        db_models.JobStatus.flow,
+                        db_models.JobStatus.flow_stage,
+                        literal(datetime.now(), db_models.ArchivedJobs.archived.type),
+                    )
+                    .join(db_models.JobStatus, db_models.JobStatus.job == db_models.Jobs.id)
+                    .where(db_models.Jobs.id.in_(job_ids)),
+                )
+            )
+            db.execute(delete(db_models.JobStatus).where(db_models.JobStatus.job.in_(job_ids)))
+            db.execute(delete(db_models.Jobs).where(db_models.Jobs.id.in_(job_ids)))
+            db.commit()
+        except IntegrityError:  # archived concurrently by another worker
+            db.rollback()
+            return archived
+        archived += len(job_ids)
+        if len(job_ids) < batch_size:
+            return archived
+
+
+def _get_idempotency_key(
+    db: Session, key: str, user_id: str, route: str
+) -> Optional[db_models.IdempotencyKeys]:
+    return (
+        db.query(db_models.IdempotencyKeys)
+        .filter(
+            db_models.IdempotencyKeys.user_id == user_id,
+            db_models.IdempotencyKeys.route == route,
+            db_models.IdempotencyKeys.key == key,
+        )
+        .first()
+    )
+
+
+def claim_idempotency_key(
+    db: Session,
+    key: str,
+    user_id: str,
+    route: str,
+    request_hash: str,
+    ttl: timedelta,
+    lease: timedelta,
+) -> Optional[db_models.IdempotencyKeys]:
+    """Claim an idempotency key for a request.
+
+    Returns None if the key was claimed by this request, otherwise the existing (unexpired) key,
+    which either holds the stored response or is still pending (response is None). A key still
+    pending <lease> after it was claimed (e.g. its request's worker died) can be claimed again.
+    """
+    now = datetime.now()
+    existing = _get_idempotency_key(db, key, user_id, route)
+    if existing is not None:
+        abandoned = existing.response is None and (
+            existing.claimed_at is None or existing.claimed_at + lease < now
+        )
+        if existing.expires >= now and not abandoned:
+            return existing
+        db.delete(existing)
+        db.commit()
+    idempotency_key = db_models.IdempotencyKeys(
+        key=key,
+        user_id=user_id,
+        route=route,
+        request_hash=request_hash,
+        expires=now + ttl,
+        claimed_at=now,
+    )
+    db.add(idempotency_key)
     try:
-        state = flows[job_flow][job_status.flow_stage]
-    except IndexError:
-        state = flows[job_flow][-1]
-    else:
-        job_status.flow_stage += 1
         db.commit()
-        db.refresh(job_status)
+    except IntegrityError:  # claimed concurrently by another request
+        db.rollback()
+        return _get_idempotency_key(db, key, user_id, route)
+    return None
+
 
-    return dict(
-        zip(["response_code", "response_text", "logging", "output_data"], state)
+def store_idempotent_response(
+    db: Session, key: str, user_id: str, route: str, status_code: int, response: str
+) -> None:
+    idempotency_key = _get_idempotency_key(db, key, user_id, route)
+    if idempotency_key is None:
+        return
+    idempotency_key.status_code = status_code
+    idempotency_key.response = response
+    db.commit()
+
+
+def release_idempotency_key(db: Session, key: str, user_id: str, route: str) -> None:
+    """Release a claimed key (e.g. after a failed request) so that it can be retried."""
+    db.query(db_models.IdempotencyKeys).filter(
+        db_models.IdempotencyKeys.user_id == user_id,
+        db_models.IdempotencyKeys.route == route,
+        db_models.IdempotencyKeys.key == key,
+    ).delete()
+    db.commit()
+
+
+def delete_expired_idempotency_keys(db: Session) -> int:
+    deleted = (
+        db.query(db_models.IdempotencyKeys)
+        .filter(db_models.IdempotencyKeys.expires < datetime.now())
+        .delete()
+    )
+    db.commit()
+    return deleted
+
+
+def claim_notifications(
+    db: Session, channel: str, claim: str, lease: timedelta, limit: int = 100
+) -> List[db_models.Outbox]:
+    """Claim up to <limit> due, pending notifications of a <channel> for delivery.
+
+    Claimed notifications are not due again until <lease> has passed, so that they are retried if
+    the claiming dispatcher dies before marking them sent or rescheduling them.
+    """
+    now = datetime.now()
+    due = (
+        select(db_models.Outbox.id)
+        .where(
+            db_models.Outbox.channel == channel,
+            db_models.Outbox.status == "pending",
+            db_models.Outbox.next_attempt <= now,
+        )
+        .order_by(db_models.Outbox.next_attempt)
+        .limit(limit)
+    )
+    db.execute(
+        update(db_models.Outbox)
+        .where(db_models.Outbox.id.in_(due), db_models.Outbox.next_attempt <= now)
+        .values(claim=claim, next_attempt=now + lease)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return (
+        db.query(db_models.Outbox)
+        .filter(db_models.Outbox.claim == claim, db_models.Outbox.status == "pending")
+        .order_by(db_models.Outbox.id)
+        .all()
     )
+
+
+def mark_notifications_sent(db: Session, notification_ids: List[int]) -> None:
+    db.execute(
+        update(db_models.Outbox)
+        .where(db_models.Outbox.id.in_(notification_ids))
+        .values(status="sent", claim=None, attempts=db_models.Outbox.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def reschedule_notifications(
+    db: Session,
+    notification_ids: List[int],
+    error: str,
+    next_attempt: datetime,
+    max_attempts: int,
+) -> None:
+    """Record a failed delivery of notifications, to be retried at <next_attempt>.
+
+    Notifications that have failed <max_attempts> times are marked as failed and not retried.
+    """
+    db.execute(
+        update(db_models.Outbox)
+        .where(db_models.Outbox.id.in_(notification_ids))
+        .values(
+            status=case(
+                (db_models.Outbox.attempts + 1 >= max_attempts, "failed"), else_="pending"
+            ),
+            claim=None,
+            attempts=db_models.Outbox.attempts + 1,
+            next_attempt=next_attempt,
+            last_error=error[:1000],
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def delete_old_notifications(db: Session, older_than: timedelta) -> int:
+    """Delete sent and failed notifications created more than <older_than> ago."""
+    deleted = db.execute(
+        delete(db_models.Outbox)
+        .where(
+            db_models.Outbox.status != "pending",
+            db_models.Outbox.created < datetime.now() - older_than,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return deleted
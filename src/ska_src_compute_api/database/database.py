@@ -1,11 +1,52 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./compute.db"
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./compute.db")
+SQLALCHEMY_READ_DATABASE_URL = os.environ.get("DATABASE_READ_URL")
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False}
+    if SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+    else {},
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def is_sqlite_file(url):
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+# Use write-ahead logging for sqlite databases, so that reads and writes do not block each other.
+#
+if is_sqlite_file(engine.url):
+
+    @event.listens_for(engine, "connect")
+    def enable_wal(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+# Engine for read-only requests: a replica at DATABASE_READ_URL if set, otherwise, for a sqlite
+# database, a separate pool of read-only connections to the same file (of DATABASE_READ_POOL_SIZE
+# connections), otherwise the primary engine.
+#
+if SQLALCHEMY_READ_DATABASE_URL:
+    read_engine = create_engine(
+        SQLALCHEMY_READ_DATABASE_URL,
+        connect_args={"check_same_thread": False}
+        if SQLALCHEMY_READ_DATABASE_URL.startswith("sqlite")
+        else {},
+    )
+elif is_sqlite_file(engine.url):
+    read_engine = create_engine(
+        "sqlite:///file:{}?mode=ro&uri=true".format(engine.url.database),
+        connect_args={"check_same_thread": False},
+        pool_size=int(os.environ.get("DATABASE_READ_POOL_SIZE", 10)),
+    )
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
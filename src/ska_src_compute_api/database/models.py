@@ -1,9 +1,20 @@
 from ska_src_compute_api.database.database import Base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, PickleType
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    DateTime,
+    ForeignKey,
+    Index,
+    PickleType,
+    Text,
+    UniqueConstraint,
+)
 
 
 class Provisions(Base):
     __tablename__ = "provisions"
+    __table_args__ = (Index("ix_provisions_user_id_id", "user_id", "id"),)  # for listings
     id = Column(Integer, primary_key=True)
     user_id = Column(String)
     validity = Column(DateTime)
@@ -18,13 +29,18 @@ class Provisions(Base):
 
 class Jobs(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_user_id_id", "user_id", "id"),  # for listings
+        {"sqlite_autoincrement": True},  # ids are not reused after archival
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(String)
     container = Column(String)
     params = Column(PickleType)
     dataset = Column(String)
     contact_email = Column(String, nullable=True)
-    provision = Column(Integer, ForeignKey("provisions.id"))
+    callback_url = Column(String, nullable=True)
+    provision = Column(Integer, ForeignKey("provisions.id"), index=True)
 
 
 class JobStatus(Base):
@@ -32,4 +48,68 @@ class JobStatus(Base):
     id = Column(Integer, primary_key=True)
     flow = Column(String)
     flow_stage = Column(Integer)
-    job = Column(Integer, ForeignKey("jobs.id"))
+    job = Column(Integer, ForeignKey("jobs.id"), index=True)
+
+
+class ArchivedJobs(Base):
+    """Completed jobs (with their final status) moved out of the jobs and jobstatus tables.
+
+    Job ids are not primary keys here, as sqlite may reuse the ids of deleted jobs.
+    """
+
+    __tablename__ = "archivedjobs"
+    __table_args__ = (
+        UniqueConstraint("job", "provision"),
+        Index("ix_archivedjobs_user_id_job", "user_id", "job"),  # for listings
+    )
+    id = Column(Integer, primary_key=True)
+    job = Column(Integer)
+    user_id = Column(String)
+    container = Column(String)
+    params = Column(PickleType)
+    dataset = Column(String)
+    contact_email = Column(String, nullable=True)
+    callback_url = Column(String, nullable=True)
+    provision = Column(Integer, index=True)
+    flow = Column(String)
+    flow_stage = Column(Integer)
+    archived = Column(DateTime)
+
+
+class IdempotencyKeys(Base):
+    __tablename__ = "idempotencykeys"
+    __table_args__ = (UniqueConstraint("user_id", "route", "key"),)
+    id = Column(Integer, primary_key=True)
+    key = Column(String)
+    user_id = Column(String)
+    route = Column(String)
+    request_hash = Column(String)
+    status_code = Column(Integer, nullable=True)
+    response = Column(String, nullable=True)
+    expires = Column(DateTime, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+
+
+class Outbox(Base):
+    """Notifications of job state changes, written in the same transaction as the change and
+    delivered asynchronously.
+
+    <status> is one of "pending", "sent" or "failed". Pending notifications are due at
+    <next_attempt>; <claim> identifies the dispatcher currently delivering them.
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index("ix_outbox_channel_status_next_attempt", "channel", "status", "next_attempt"),
+    )
+    id = Column(Integer, primary_key=True)
+    job = Column(Integer)
+    channel = Column(String)
+    destination = Column(String)
+    payload = Column(Text)
+    created = Column(DateTime)
+    status = Column(String)
+    attempts = Column(Integer)
+    next_attempt = Column(DateTime)
+    claim = Column(String, nullable=True, index=True)
+    last_error = Column(String, nullable=True)
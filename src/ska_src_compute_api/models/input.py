@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import AnyHttpUrl, BaseModel, Field
+from typing import List, Optional
 from enum import Enum
 from datetime import datetime, timedelta
 
@@ -31,6 +31,12 @@ class QueryInput(Input):
     )
 
 
+class BatchQueryInput(Input):
+    queries: List[QueryInput] = Field(
+        description="Resource shapes to evaluate", min_items=1, max_items=1000
+    )
+
+
 class JobInput(Input):
     container: str = Field(
         examples=["astroimaging/sourcefinder:3.4"],
@@ -48,3 +54,7 @@ class JobInput(Input):
         examples=["jdoe@astro.demouniversity.org"],
         description="email address for notiffications about the job.",
     )
+    callback_url: Optional[AnyHttpUrl] = Field(
+        examples=["https://orchestrator.demouniversity.org/hooks/compute"],
+        description="URL to POST (signed) notifications of the job's state changes to.",
+    )
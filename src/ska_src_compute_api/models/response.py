@@ -1,4 +1,4 @@
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 from datetime import datetime, timedelta
 
 from pydantic import BaseModel, Field, NonNegativeInt, AnyHttpUrl
@@ -38,6 +38,43 @@ class QueryResponse(Response):
     response_text: str = Field(examples=["10 CPUs and K100 not available."])
 
 
+class FederatedQueryResponse(QueryResponse):
+    class SiteQueryResponse(BaseModel):
+        site: str = Field(examples=["spsrc"])
+        response_code: NonNegativeInt = Field(
+            description="Response code; see README", examples=[0]
+        )
+        response_text: str = Field(examples=["Ok"])
+        data_local: bool = Field(
+            description="Whether the site holds the requested data location", examples=[True]
+        )
+        cached: bool = Field(
+            description="Whether the answer was served from the broker's cache", examples=[False]
+        )
+        latency_ms: float = Field(description="Time taken by the site to answer", examples=[12.5])
+
+    site: Optional[str] = Field(description="Best site to provision at", examples=["spsrc"])
+    sites: List[SiteQueryResponse] = Field(description="Answers of all sites, best first")
+
+
+class BatchQueryResponse(Response):
+    constraints: List[str] = Field(
+        description="Constraints checked, in the order of the columns of the feasibility matrix",
+        examples=[["data_location", "cpu_cores", "gpu_model", "memory", "deadline"]],
+    )
+    feasibility: List[List[bool]] = Field(
+        description="Per shape (in the order queried), whether each constraint is met",
+        examples=[[[True, True, True, True, True], [True, True, False, True, True]]],
+    )
+    response_codes: List[NonNegativeInt] = Field(
+        description="Per shape, the response code of querying for it alone; see README",
+        examples=[[0, 1]],
+    )
+    earliest_start: List[Optional[datetime]] = Field(
+        description="Per shape, the earliest time it can start (None if it cannot run here)"
+    )
+
+
 class ProvisionResponse(Response):
     response_code: NonNegativeInt = Field(
         description="Response code; see README", examples=[2]
@@ -83,3 +120,37 @@ class JobStatusResponse(Response):
         description="Output data location.",
         examples=["https://drive.surf.nl/SKA_files/job_24/output_dir/"],
     )
+
+
+class ProvisionListResponse(Response):
+    class ProvisionSummary(BaseModel):
+        provision_id: str = Field(examples=["spsrc-12.prov"])
+        provision_validity: datetime = Field(description="Validity of the provision")
+        active: bool = Field(description="Whether the provision is still valid", examples=[True])
+        data_location: str = Field(examples=["SPSRC"])
+        data_size: int = Field(examples=[60000])
+        output_data_size: int = Field(examples=[8000])
+        memory: int = Field(examples=[196])
+        cpu_cores: int = Field(examples=[16])
+        runtime: int = Field(examples=[72])
+        gpu_model: Optional[str] = Field(examples=["K40"])
+
+    provisions: List[ProvisionSummary]
+    next_cursor: Optional[str] = Field(
+        description="Cursor for the next page (None if this is the last page)"
+    )
+
+
+class JobListResponse(Response):
+    class JobSummary(BaseModel):
+        job_id: str = Field(examples=["spsrc-12.job"])
+        provision_id: str = Field(examples=["spsrc-12.prov"])
+        provision_validity: datetime = Field(description="Validity of the provision")
+        running: bool = Field(description="Whether the job is still running", examples=[False])
+        container: str = Field(examples=["astroimaging/sourcefinder:3.4"])
+        dataset: str = Field(examples=["https://webdav.data.skao.int/3811823/dataproduct.fits"])
+
+    jobs: List[JobSummary]
+    next_cursor: Optional[str] = Field(
+        description="Cursor for the next page (None if this is the last page)"
+    )
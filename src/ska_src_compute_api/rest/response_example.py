@@ -1,59 +1,187 @@
 from ska_src_compute_api.models import (
+    BatchQueryInput,
+    BatchQueryResponse,
     QueryInput,
     QueryResponse,
     ProvisionResponse,
     JobInput,
     JobSubmissionResponse,
     JobStatusResponse,
+    ProvisionListResponse,
+    JobListResponse,
 )
+import base64
+import os
 from datetime import datetime, timedelta
+from typing import Optional
+import numpy as np
+from ska_src_compute_api.common.caching import make_etag, VersionedCache
+from ska_src_compute_api.common.data_locality import DataLocationIndex
+from ska_src_compute_api.common.exceptions import InvalidCursor
+from ska_src_compute_api.common.identifiers import IdentifierCodec, JOB, PROVISION
+from ska_src_compute_api.common.tracing import tracer
 from ska_src_compute_api.database import crud, models
 from ska_src_compute_api.database.database import engine
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
 
 models.Base.metadata.create_all(bind=engine)
 
+# Create any (nullable) columns and indexes added to the models since their tables were created.
+#
+inspector = inspect(engine)
+for table in models.Base.metadata.sorted_tables:
+    table_columns = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in table_columns:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        "ALTER TABLE {} ADD COLUMN {} {}".format(
+                            table.name, column.name, column.type.compile(engine.dialect)
+                        )
+                    )
+                )
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+# Name of this site, used as the prefix of provision and job ids.
+#
+MY_SITE = os.environ.get("SITE_NAME", "spsrc")
+
+# Codec for provision and job ids. If ID_SIGNING_KEY is set, ids are signed so that they cannot be
+# enumerated.
+#
+IDS = IdentifierCodec(MY_SITE, key=os.environ.get("ID_SIGNING_KEY") or None)
+
+# Index of the sites hosting datasets, loaded from DATA_LOCATIONS_PATH if set (and reloaded when
+# the file changes). By default, datasets held by the SKAO and IAA-CSIC, and the demo city data,
+# are local to this site.
+#
+DATA_LOCATIONS = DataLocationIndex.from_file(
+    os.environ.get("DATA_LOCATIONS_PATH"),
+    default_entries=[
+        {"host": "skao.int", "sites": [MY_SITE]},
+        {"host": "iaa.csic.es", "sites": [MY_SITE]},
+        {"prefix": "/demo_city/", "sites": [MY_SITE]},
+    ],
+)
+
+# Capacity of this site: CPU cores (in total and currently available), GPU models and memory (in
+# GB).
+#
+MY_NUM_CPU = 100
+MY_CURRENT_CPU_AVAIL = 40
+MY_GPU = ["K40", "RX7900XT"]
+MY_MAX_MEM = 100
+
+# Requests for more CPU cores than are currently available can only be booked for deadlines
+# beyond this horizon.
+#
+BOOKING_HORIZON = timedelta(days=5)
+
+# Cache of rendered query answers, invalidated whenever capacity changes (i.e. a provision is
+# created). Entries also expire after QUERY_CACHE_TTL seconds, which bounds how long the expiry of
+# a provision takes to be reflected.
+#
+# The cache is per process: with several workers, a provision only invalidates the cache of the
+# worker serving it, and the others may serve stale answers (and ETags) for up to QUERY_CACHE_TTL
+# seconds.
+#
+QUERY_CACHE = VersionedCache(ttl=float(os.environ.get("QUERY_CACHE_TTL", 30)))
+
+
+def get_query_cache_key(query_input: QueryInput) -> tuple:
+    """Normalise a query to the fields that determine its answer.
+
+    The deadline only matters as far as whether it falls within the booking horizon.
+    """
+    return (
+        query_input.data_location,
+        query_input.cpu_cores,
+        query_input.gpu_model,
+        query_input.memory,
+        query_input.deadline < datetime.now() + BOOKING_HORIZON,
+    )
+
 
 def query_resources(query_input: QueryInput) -> QueryResponse:
-    my_num_cpu = 100
-    my_current_cpu_avail = 40
-    my_gpu = ["K40", "RX7900XT"]
-    my_max_mem = 100
     response_code, response_text = 0, "Ok"
-    if query_input.data_location != "SPSRC":
-        response_code = 3
-        response_text = "Internal error. Could not connect to the database."
-        return QueryResponse.parse_obj(
-            {"response_code": response_code, "response_text": response_text}
-        )
     availability = True
     unavail_msg = ""
-    if query_input.cpu_cores > my_num_cpu:
+    if query_input.cpu_cores > MY_NUM_CPU:
         availability = False
         unavail_msg += "Number of requested CPU cores not available. "
-    if query_input.gpu_model not in my_gpu:
+    if query_input.gpu_model not in MY_GPU:
         availability = False
         unavail_msg += f"{query_input.gpu_model} GPU not available"
-    if query_input.memory > my_max_mem:
+    if query_input.memory > MY_MAX_MEM:
         availability = False
         unavail_msg += "Requested memory not available"
     if not availability:
         response_code = 1
         response_text = unavail_msg
-        return QueryResponse.parse_obj(
-            {"response_code": response_code, "response_text": response_text}
+        return QueryResponse.construct(
+            response_code=response_code, response_text=response_text
         )
     if (
-        query_input.cpu_cores > my_current_cpu_avail
-        and query_input.deadline < datetime.now() + timedelta(days=5)
+        query_input.cpu_cores > MY_CURRENT_CPU_AVAIL
+        and query_input.deadline < datetime.now() + BOOKING_HORIZON
     ):
         availability = False
         unavail_msg = "Number of requested CPU cores not bookable."
     if not availability:
         response_code = 2
         response_text = unavail_msg
-    return QueryResponse.parse_obj(
-        {"response_code": response_code, "response_text": response_text}
+    elif query_input.data_location != MY_SITE.upper():
+        response_code = 4
+        response_text = "Data location {} not held at this site.".format(
+            query_input.data_location
+        )
+    return QueryResponse.construct(
+        response_code=response_code, response_text=response_text
+    )
+
+
+def query_resources_batch(batch_input: BatchQueryInput) -> BatchQueryResponse:
+    """Evaluate many resource shapes at once against the capacity of this site.
+
+    Gives, per shape, the same response code as query_resources, whether each constraint is met
+    and the earliest time it can start, with the checks vectorised over all shapes.
+    """
+    queries = batch_input.queries
+    count = len(queries)
+    now = datetime.now()
+    local = np.fromiter(
+        (query.data_location == MY_SITE.upper() for query in queries), dtype=bool, count=count
+    )
+    cpu_cores = np.fromiter((query.cpu_cores for query in queries), dtype=np.int64, count=count)
+    memory = np.fromiter((query.memory for query in queries), dtype=np.int64, count=count)
+    gpu_models = np.array(
+        [query.gpu_model.value if query.gpu_model else "" for query in queries], dtype=str
+    )
+    deadlines = np.fromiter(
+        (query.deadline.timestamp() for query in queries), dtype=np.float64, count=count
+    )
+
+    cpu_available = cpu_cores <= MY_NUM_CPU
+    gpu_available = np.isin(gpu_models, MY_GPU)
+    memory_available = memory <= MY_MAX_MEM
+    available = cpu_available & gpu_available & memory_available
+    # cores beyond those currently available can be booked from the end of the booking horizon
+    bookable_now = cpu_cores <= MY_CURRENT_CPU_AVAIL
+    bookable = bookable_now | (deadlines >= (now + BOOKING_HORIZON).timestamp())
+
+    response_codes = np.select([~available, ~bookable, ~local], [1, 2, 4], default=0)
+    start_times = (now, now + BOOKING_HORIZON, None)
+    start_indices = np.where(local & available, np.where(bookable_now, 0, 1), 2)
+    return BatchQueryResponse.construct(
+        constraints=["data_location", "cpu_cores", "gpu_model", "memory", "deadline"],
+        feasibility=np.column_stack(
+            [local, cpu_available, gpu_available, memory_available, bookable]
+        ).tolist(),
+        response_codes=response_codes.tolist(),
+        earliest_start=[start_times[index] for index in start_indices.tolist()],
     )
 
 
@@ -61,34 +189,137 @@ def provision_resources(provision_input: QueryInput, db: Session, user_id: str):
     availability = query_resources(provision_input)
     if availability.response_code:
         return availability
-    provision = crud.add_provision(db, provision_input, user_id)
-    my_site = "spsrc"
-    provision_ref = f"{my_site}-{provision.id}.prov"
-    return ProvisionResponse.parse_obj(
-        {
-            "response_code": availability.response_code,
-            "response_text": availability.response_text,
-            "provision_id": provision_ref,
-            "provision_validity": provision.validity,
-        }
+    with tracer.start_as_current_span("crud.add_provision"):
+        provision = crud.add_provision(db, provision_input, user_id)
+    QUERY_CACHE.invalidate()
+    provision_ref = IDS.encode(provision.id, PROVISION)
+    return ProvisionResponse.construct(
+        response_code=availability.response_code,
+        response_text=availability.response_text,
+        provision_id=provision_ref,
+        provision_validity=provision.validity,
     )
 
 
 def submit_job(job_input: JobInput, provision_id: str, db: Session, user_id: str):
-    my_site = "spsrc"
-    job = crud.add_job(
-        job_data=job_input,
-        provision_id=provision_id,
-        db=db,
-        data_centre=my_site,
-        user_id=user_id,
-    )
+    with tracer.start_as_current_span("crud.add_job"):
+        job = crud.add_job(
+            job_data=job_input,
+            provision_id=provision_id,
+            db=db,
+            data_centre=MY_SITE,
+            user_id=user_id,
+            data_locations=DATA_LOCATIONS,
+            ids=IDS,
+        )
     if job:
-        return JobSubmissionResponse.parse_obj(job)
+        return JobSubmissionResponse.construct(**job)
 
 
 def job_status(provision_id: str, db: Session, user_id: str):
-    current_job_status = crud.get_job_status(
-        db=db, provision_id=provision_id, user_id=user_id
+    """Get the status of the job for a provision.
+
+    Returns the status, its ETag (a hash of the encoded job id, stage and log length; None if
+    there is no job) and whether the status is final.
+    """
+    with tracer.start_as_current_span("crud.get_job_status"):
+        current_job_status, job_state = crud.get_job_status(
+            db=db, provision_id=provision_id, user_id=user_id, ids=IDS
+        )
+    if job_state is None:
+        return JobStatusResponse.construct(**current_job_status), None, False
+    job_id, stage, final = job_state
+    etag = make_etag(
+        "{}-{}-{}".format(
+            IDS.encode(job_id, JOB), stage, len(current_job_status["logging"] or "")
+        ).encode()
+    )
+    return JobStatusResponse.construct(**current_job_status), etag, final
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except ValueError:
+        raise InvalidCursor
+
+
+def list_provisions(
+    db: Session,
+    user_id: str,
+    active: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+):
+    with tracer.start_as_current_span("crud.list_provisions"):
+        provisions = crud.list_provisions(
+            db=db,
+            user_id=user_id,
+            active=active,
+            since=since,
+            until=until,
+            before_id=decode_cursor(cursor),
+            limit=limit + 1,
+        )
+    now = datetime.now()
+    return ProvisionListResponse.construct(
+        provisions=[
+            ProvisionListResponse.ProvisionSummary.construct(
+                provision_id=IDS.encode(provision.id, PROVISION),
+                provision_validity=provision.validity,
+                active=provision.validity >= now,
+                data_location=provision.data_location,
+                data_size=provision.data_size,
+                output_data_size=provision.output_data_size,
+                memory=provision.memory,
+                cpu_cores=provision.cpu_cores,
+                runtime=provision.runtime,
+                gpu_model=provision.gpu_model,
+            )
+            for provision in provisions[:limit]
+        ],
+        next_cursor=encode_cursor(provisions[limit - 1].id) if len(provisions) > limit else None,
+    )
+
+
+def list_jobs(
+    db: Session,
+    user_id: str,
+    running: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+):
+    with tracer.start_as_current_span("crud.list_jobs"):
+        jobs = crud.list_jobs(
+            db=db,
+            user_id=user_id,
+            running=running,
+            since=since,
+            until=until,
+            before_id=decode_cursor(cursor),
+            limit=limit + 1,
+        )
+    return JobListResponse.construct(
+        jobs=[
+            JobListResponse.JobSummary.construct(
+                job_id=IDS.encode(job.job_id, JOB),
+                provision_id=IDS.encode(job.provision, PROVISION),
+                provision_validity=job.provision_validity,
+                running=job.flow_stage < len(crud.flows[job.flow]),
+                container=job.container,
+                dataset=job.dataset,
+            )
+            for job in jobs[:limit]
+        ],
+        next_cursor=encode_cursor(jobs[limit - 1].job_id) if len(jobs) > limit else None,
     )
-    return JobStatusResponse.parse_obj(current_job_status)
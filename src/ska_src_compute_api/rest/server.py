@@ -1,54 +1,102 @@
 import asyncio
 import copy
+import hashlib
 import json
 import os
+import tempfile
 import time
-from typing import Union
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Union
 import jwt
 
 from authlib.integrations.requests_client import OAuth2Session
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, Response
 from fastapi.security import HTTPBearer
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from fastapi_versionizer.versionizer import api_version, versionize
 from jinja2 import Template
 from starlette.config import Config
 from starlette.requests import Request
-from starlette.responses import JSONResponse
 
 from ska_src_compute_api import models
+from ska_src_compute_api.common.admission import (
+    AdmissionControlMiddleware,
+    render_metrics,
+    RouteClass,
+)
+from ska_src_compute_api.common.caching import etag_matches, make_etag, VersionedCache
+from ska_src_compute_api.common.compression import CompressionMiddleware
 from ska_src_compute_api.common.constants import Constants
-from ska_src_compute_api.common.exceptions import handle_exceptions, PermissionDenied
+from ska_src_compute_api.common.exceptions import (
+    handle_exceptions,
+    IdempotencyKeyInProgress,
+    IdempotencyKeyMismatch,
+    PermissionDenied,
+    QuotaExceeded,
+    RateLimited,
+)
+from ska_src_compute_api.common.federation import FederationBroker, SiteRegistry
+from ska_src_compute_api.common.notifications import (
+    LogSender,
+    OutboxDispatcher,
+    SMTPSender,
+    WebhookDispatcher,
+    WebhookURLPolicy,
+)
+from ska_src_compute_api.common.profiling import ProfilingMiddleware, RequestProfiler
+from ska_src_compute_api.common.rate_limiting import format_retry_after, get_rate_limiter
+from ska_src_compute_api.common.read_your_writes import (
+    mark_write,
+    ReadYourWritesMiddleware,
+    wrote_recently,
+)
+from ska_src_compute_api.common.request_logging import (
+    configure_logging,
+    instrument_slow_queries,
+    logger,
+    RequestLoggingMiddleware,
+)
+from ska_src_compute_api.common.tracing import (
+    configure_tracing,
+    instrument_engine,
+    tracer,
+    TracingMiddleware,
+)
 from ska_src_compute_api.common.utility import (
     convert_readme_to_html_docs,
     get_api_server_url_from_request,
     get_base_url_from_request,
     get_url_for_app_from_request,
 )
+from ska_src_compute_api.common.workers import BackgroundTaskLock
 from ska_src_permissions_api.client.permissions import PermissionsClient
 from response_example import (
+    get_query_cache_key,
+    list_jobs,
+    list_provisions,
+    QUERY_CACHE,
     query_resources,
+    query_resources_batch,
     provision_resources,
     submit_job,
     job_status,
 )
 
 from sqlalchemy.orm import Session
-from ska_src_compute_api.database.database import SessionLocal
+from ska_src_compute_api.database import crud
+from ska_src_compute_api.database.database import (
+    engine,
+    read_engine,
+    ReadSessionLocal,
+    SessionLocal,
+)
 
 config = Config(".env")
 
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 # Debug mode (runs unauthenticated)
 #
 DEBUG = True if config.get("DISABLE_AUTHENTICATION", default=None) == "yes" else False
@@ -56,16 +104,102 @@ DEBUG = True if config.get("DISABLE_AUTHENTICATION", default=None) == "yes" else
 
 # Instantiate FastAPI() allowing CORS. Static mounts must be added later after the versionize() call.
 #
+# Responses are serialised with orjson by default.
+#
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Compress large job status and documentation responses. Documentation, openapi schemas and static
+# files do not change at runtime so their compressed variants are cached.
+#
+app.add_middleware(
+    CompressionMiddleware,
+    paths=[r"/provision/[^/]+/status$"],
+    cacheable_paths=[r"/www/docs/", r"/openapi\.json$", r"^/static/"],
+    minimum_size=int(config.get("COMPRESSION_MINIMUM_SIZE", default=1024)),
+)
+
+# Admission control. At most ADMISSION_{READ,WRITE}_LIMIT requests (0 for no limit) of each route
+# class are in flight at once in a worker, with up to ADMISSION_{READ,WRITE}_QUEUE_SIZE more
+# waiting for at most ADMISSION_MAX_WAIT seconds. Other requests are shed with a 503, so that an
+# overloaded worker (e.g. behind a slow database or Permissions API) fails fast rather than
+# queueing requests until clients time out. Status, documentation and admin routes are not limited.
+#
+ADMISSION_ROUTE_CLASSES = [
+    RouteClass(
+        "write",
+        [("PUT", r"/provision$"), ("PUT", r"/provision/[^/]+/submit$")],
+        limit=int(config.get("ADMISSION_WRITE_LIMIT", default=0)),
+        queue_size=int(config.get("ADMISSION_WRITE_QUEUE_SIZE", default=16)),
+        max_wait=float(config.get("ADMISSION_MAX_WAIT", default=0.5)),
+    ),
+    RouteClass(
+        "read",
+        [
+            (None, r"/(federation/)?query$"),
+            ("POST", r"/query/batch$"),
+            ("GET", r"/provision/[^/]+/status$"),
+            ("GET", r"/(provisions|jobs)$"),
+        ],
+        limit=int(config.get("ADMISSION_READ_LIMIT", default=0)),
+        queue_size=int(config.get("ADMISSION_READ_QUEUE_SIZE", default=64)),
+        max_wait=float(config.get("ADMISSION_MAX_WAIT", default=0.5)),
+    ),
+]
+app.add_middleware(
+    AdmissionControlMiddleware,
+    route_classes=ADMISSION_ROUTE_CLASSES,
+    retry_after=int(config.get("ADMISSION_RETRY_AFTER", default=1)),
+)
 
-app = FastAPI()
+# Allow CORS. Added after (so outside) admission control, so that shed requests get CORS headers
+# and browsers can read their Retry-After.
+#
 CORSMiddleware_params = {
     "allow_origins": ["*"],
     "allow_credentials": True,
     "allow_methods": ["*"],
     "allow_headers": ["*"],
+    "expose_headers": ["Retry-After"],
 }
 app.add_middleware(CORSMiddleware, **CORSMiddleware_params)
 
+# Configure structured (JSON) logging of requests and slow SQL statements.
+#
+configure_logging(config.get("LOG_LEVEL", default="INFO"))
+DATABASE_ENGINES = [engine] if read_engine is engine else [engine, read_engine]
+for database_engine in DATABASE_ENGINES:
+    instrument_slow_queries(
+        database_engine,
+        threshold_ms=float(config.get("SLOW_QUERY_THRESHOLD_MS", default=100)),
+    )
+app.add_middleware(
+    RequestLoggingMiddleware,
+    slow_request_threshold_ms=float(config.get("SLOW_REQUEST_THRESHOLD_MS", default=1000)),
+)
+
+# Configure the request profiler. Single requests are profiled either when armed via the
+# /admin/profile route or when carrying an X-Profile header matching PROFILING_TOKEN (if set).
+#
+PROFILER = RequestProfiler(
+    output_dir=config.get("PROFILING_OUTPUT_DIR", default="profiles"),
+    token=config.get("PROFILING_TOKEN", default=None),
+)
+app.add_middleware(ProfilingMiddleware, profiler=PROFILER)
+
+# Configure tracing. Each request gets a root span, with child spans for Permissions API calls, SQL
+# statements and response rendering.
+#
+configure_tracing(
+    service_name="ska-src-compute-api",
+    exporter=config.get("TRACING_EXPORTER", default=None),
+    otlp_endpoint=config.get("TRACING_OTLP_ENDPOINT", default=None),
+    jsonl_path=config.get("TRACING_JSONL_PATH", default="traces.jsonl"),
+    sample_rate=float(config.get("TRACING_SAMPLE_RATE", default=1.0)),
+)
+for database_engine in DATABASE_ENGINES:
+    instrument_engine(database_engine)
+app.add_middleware(TracingMiddleware)
+
 # Add HTTPBearer authz.
 #
 security = HTTPBearer()
@@ -96,12 +230,266 @@ PERMISSIONS_SERVICE_VERSION = config.get("PERMISSIONS_SERVICE_VERSION")
 #
 SERVICE_START_TIME = time.time()
 
+# Idempotency keys (and their stored responses) expire after this time. Expired keys are purged at
+# most every IDEMPOTENCY_KEY_PURGE_INTERVAL seconds. A key whose request has not completed within
+# IDEMPOTENCY_KEY_LEASE_SECONDS of claiming it (e.g. because its worker died) can be claimed by a
+# retry; this should be longer than any request can take (see WORKER_TIMEOUT).
+#
+IDEMPOTENCY_KEY_TTL = timedelta(
+    minutes=int(config.get("IDEMPOTENCY_KEY_TTL_MINUTES", default=1440))
+)
+IDEMPOTENCY_KEY_LEASE = timedelta(
+    seconds=int(config.get("IDEMPOTENCY_KEY_LEASE_SECONDS", default=120))
+)
+IDEMPOTENCY_KEY_PURGE_INTERVAL = 60
+IDEMPOTENCY_KEY_LAST_PURGE = 0
+
+# Rate limit provisioning routes per user and route with a token bucket, refilled at
+# RATE_LIMIT_RATE requests per second up to RATE_LIMIT_BURST. Buckets are kept either in process
+# memory ("memory") or in redis ("redis", shared between workers). Rate limiting is disabled by
+# default. As each worker would allow the full rate, "memory" is refused with more than one worker.
+#
+RATE_LIMIT_BACKEND = config.get("RATE_LIMIT_BACKEND", default="none")
+if RATE_LIMIT_BACKEND == "memory" and int(os.environ.get("WORKERS") or 1) > 1:
+    raise ValueError(
+        "RATE_LIMIT_BACKEND=memory cannot be used with WORKERS > 1, use RATE_LIMIT_BACKEND=redis"
+    )
+RATE_LIMITER = get_rate_limiter(
+    backend=RATE_LIMIT_BACKEND,
+    rate=float(config.get("RATE_LIMIT_RATE", default=1)),
+    burst=float(config.get("RATE_LIMIT_BURST", default=10)),
+    redis_url=config.get("RATE_LIMIT_REDIS_URL", default="redis://localhost:6379/0"),
+)
+
+# Per-user caps on active (unexpired) provisions and running jobs (0 for no limit).
+#
+MAX_ACTIVE_PROVISIONS = int(config.get("MAX_ACTIVE_PROVISIONS", default=0))
+MAX_RUNNING_JOBS = int(config.get("MAX_RUNNING_JOBS", default=0))
+QUOTA_RETRY_AFTER = 30
+
+# Federation broker, fanning out queries to the compute sites listed in FEDERATION_SITES_PATH
+# (disabled if unset). Each site has FEDERATION_SITE_TIMEOUT seconds to answer and answers are
+# cached for FEDERATION_CACHE_TTL seconds.
+#
+FEDERATION_SITES_PATH = config.get("FEDERATION_SITES_PATH", default=None)
+BROKER = (
+    FederationBroker(
+        SiteRegistry.from_file(FEDERATION_SITES_PATH),
+        timeout=float(config.get("FEDERATION_SITE_TIMEOUT", default=2)),
+        cache_ttl=float(config.get("FEDERATION_CACHE_TTL", default=10)),
+    )
+    if FEDERATION_SITES_PATH
+    else None
+)
+
+# Completed jobs are moved to the archive table ARCHIVE_JOBS_AFTER_DAYS days after their provision
+# expired (0 to never archive), checked every ARCHIVE_INTERVAL_SECONDS.
+#
+ARCHIVE_JOBS_AFTER = timedelta(days=int(config.get("ARCHIVE_JOBS_AFTER_DAYS", default=30)))
+ARCHIVE_INTERVAL = int(config.get("ARCHIVE_INTERVAL_SECONDS", default=3600))
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVER_TASK = None
+
+# Background tasks (job archival and notification delivery) run in one worker only: the one
+# holding the lock on BACKGROUND_TASKS_LOCK_PATH. The other workers try to take the lock over every
+# BACKGROUND_TASKS_LOCK_INTERVAL seconds, in case that worker exits.
+#
+BACKGROUND_TASKS_LOCK = BackgroundTaskLock(
+    config.get(
+        "BACKGROUND_TASKS_LOCK_PATH",
+        default=os.path.join(tempfile.gettempdir(), "ska-src-compute-api-background-tasks.lock"),
+    )
+)
+BACKGROUND_TASKS_LOCK_INTERVAL = 10
+
+# Email notifications of job state changes (to JobInput.contact_email), delivered from the outbox
+# every NOTIFICATION_INTERVAL_SECONDS through the SMTP server at SMTP_HOST (logged if unset).
+# Sent and failed notifications are deleted after NOTIFICATION_RETENTION_DAYS days.
+#
+NOTIFICATION_FROM = config.get("NOTIFICATION_FROM", default="compute-api@localhost")
+NOTIFICATION_DISPATCHER = OutboxDispatcher(
+    SessionLocal,
+    (
+        SMTPSender(
+            config.get("SMTP_HOST"),
+            port=int(config.get("SMTP_PORT", default=25)),
+            sender=NOTIFICATION_FROM,
+            username=config.get("SMTP_USERNAME", default=None),
+            password=config.get("SMTP_PASSWORD", default=None),
+            starttls=config.get("SMTP_STARTTLS", default="no") == "yes",
+        )
+        if config.get("SMTP_HOST", default=None)
+        else LogSender(sender=NOTIFICATION_FROM)
+    ),
+    channel="email",
+    batch_size=int(config.get("NOTIFICATION_BATCH_SIZE", default=100)),
+    workers=int(config.get("NOTIFICATION_WORKERS", default=4)),
+    max_attempts=int(config.get("NOTIFICATION_MAX_ATTEMPTS", default=5)),
+    backoff=float(config.get("NOTIFICATION_BACKOFF_SECONDS", default=30)),
+)
+NOTIFICATION_INTERVAL = float(config.get("NOTIFICATION_INTERVAL_SECONDS", default=10))
+NOTIFICATION_RETENTION = timedelta(
+    days=int(config.get("NOTIFICATION_RETENTION_DAYS", default=7))
+)
+NOTIFICATION_TASKS = []
+
+# Webhook notifications of job state changes (to JobInput.callback_url), POSTed from the outbox
+# every WEBHOOK_INTERVAL_SECONDS and signed with WEBHOOK_SIGNING_KEY (if set). Callback URLs are
+# checked at submission and before each delivery: their hosts must be in WEBHOOK_ALLOWED_HOSTS
+# (comma-separated, including subdomains; any host if unset) and, unless
+# WEBHOOK_ALLOW_PRIVATE_ADDRESSES is "yes" (e.g. for development), resolve to public addresses
+# only.
+#
+WEBHOOK_URL_POLICY = WebhookURLPolicy(
+    allowed_hosts=[
+        host.strip()
+        for host in config.get("WEBHOOK_ALLOWED_HOSTS", default="").split(",")
+        if host.strip()
+    ],
+    allow_private=config.get("WEBHOOK_ALLOW_PRIVATE_ADDRESSES", default=None) == "yes",
+)
+WEBHOOK_DISPATCHER = WebhookDispatcher(
+    SessionLocal,
+    key=config.get("WEBHOOK_SIGNING_KEY", default=None) or None,
+    batch_size=int(config.get("WEBHOOK_BATCH_SIZE", default=100)),
+    per_host_limit=int(config.get("WEBHOOK_PER_HOST_LIMIT", default=4)),
+    max_connections=int(config.get("WEBHOOK_MAX_CONNECTIONS", default=100)),
+    timeout=float(config.get("WEBHOOK_TIMEOUT", default=10)),
+    max_attempts=int(config.get("WEBHOOK_MAX_ATTEMPTS", default=8)),
+    backoff=float(config.get("WEBHOOK_BACKOFF_SECONDS", default=10)),
+    url_policy=WEBHOOK_URL_POLICY,
+)
+WEBHOOK_INTERVAL = float(config.get("WEBHOOK_INTERVAL_SECONDS", default=2))
+
+# Time for which clients and intermediaries may reuse query answers without revalidating them.
+#
+QUERY_MAX_AGE = int(config.get("QUERY_MAX_AGE", default=0))
+
+# ETags of final job statuses (which no longer change), by user and provision id, so that
+# conditional status requests for finished jobs are answered without querying the database. The
+# cache is per process, but as final statuses never change it cannot go stale.
+#
+FINAL_STATUS_ETAGS = VersionedCache(ttl=float(config.get("FINAL_STATUS_ETAG_TTL", default=86400)))
+
 # Keep track of number of managed requests.
 #
 REQUESTS_COUNTER = 0
 REQUESTS_COUNTER_LOCK = asyncio.Lock()
 
 
+# Render a response model directly with orjson.
+#
+# Response models are constructed (unvalidated) from server-side data, so this skips both FastAPI's
+# jsonable_encoder pass and any re-validation of the returned model.
+#
+def render_response(response: models.Response) -> ORJSONResponse:
+    with tracer.start_as_current_span("render_response"):
+        return ORJSONResponse(response.dict())
+
+
+# Render the answer to a query, from the query cache if possible.
+#
+# Answers carry an ETag (of the answer itself) and a Cache-Control header; a (GET) request with a
+# matching If-None-Match header gets an empty 304 response.
+#
+def render_query(query_input: models.QueryInput, if_none_match: Optional[str] = None) -> Response:
+    cache_key = get_query_cache_key(query_input)
+    cached = QUERY_CACHE.get(cache_key)
+    if cached is None:
+        body = render_response(query_resources(query_input)).body
+        cached = (body, make_etag(body))
+        QUERY_CACHE.set(cache_key, cached)
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "private, max-age={}".format(QUERY_MAX_AGE)}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Run a (non-idempotent) operation at most once per Idempotency-Key.
+#
+# The key is scoped to the user and request path. The first request claims the key, runs
+# <operation> and stores the rendered response; retries with the same key and body replay the
+# stored response without re-running the operation.
+#
+def run_idempotent(
+    db: Session,
+    idempotency_key: Optional[str],
+    user_id: str,
+    route: str,
+    request_input: models.Input,
+    operation: Callable[[], models.Response],
+) -> Response:
+    global IDEMPOTENCY_KEY_LAST_PURGE
+    if not idempotency_key:
+        return render_response(operation())
+    if time.time() - IDEMPOTENCY_KEY_LAST_PURGE > IDEMPOTENCY_KEY_PURGE_INTERVAL:
+        IDEMPOTENCY_KEY_LAST_PURGE = time.time()
+        crud.delete_expired_idempotency_keys(db)
+
+    request_hash = hashlib.sha256(request_input.json(sort_keys=True).encode()).hexdigest()
+    existing = crud.claim_idempotency_key(
+        db,
+        idempotency_key,
+        user_id,
+        route,
+        request_hash,
+        IDEMPOTENCY_KEY_TTL,
+        IDEMPOTENCY_KEY_LEASE,
+    )
+    if existing is not None:
+        if existing.request_hash != request_hash:
+            raise IdempotencyKeyMismatch
+        if existing.response is None:
+            raise IdempotencyKeyInProgress(
+                retry_after=format_retry_after(
+                    (existing.claimed_at + IDEMPOTENCY_KEY_LEASE - datetime.now()).total_seconds()
+                )
+            )
+        return Response(
+            content=existing.response,
+            status_code=existing.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"},
+        )
+    try:
+        response = render_response(operation())
+    except Exception:
+        crud.release_idempotency_key(db, idempotency_key, user_id, route)
+        raise
+    crud.store_idempotent_response(
+        db, idempotency_key, user_id, route, response.status_code, response.body.decode()
+    )
+    return response
+
+
+# Check the user's quotas before provisioning or submitting.
+#
+def check_provision_quota(db: Session, user_id: str) -> None:
+    if not MAX_ACTIVE_PROVISIONS:
+        return
+    active_provisions, first_expiry = crud.count_active_provisions(db, user_id)
+    if active_provisions >= MAX_ACTIVE_PROVISIONS:
+        raise QuotaExceeded(
+            resource="active provisions",
+            limit=MAX_ACTIVE_PROVISIONS,
+            retry_after=format_retry_after(
+                (first_expiry - datetime.now()).total_seconds()
+            ),
+        )
+
+
+def check_job_quota(db: Session, user_id: str) -> None:
+    if not MAX_RUNNING_JOBS:
+        return
+    if crud.count_running_jobs(db, user_id) >= MAX_RUNNING_JOBS:
+        raise QuotaExceeded(
+            resource="running jobs",
+            limit=MAX_RUNNING_JOBS,
+            retry_after=format_retry_after(QUOTA_RETRY_AFTER),
+        )
+
+
 # Dependencies.
 # -------------
 #
@@ -123,14 +511,15 @@ async def verify_permission_for_service_route(
     if authorization.credentials is None:
         raise PermissionDenied
     access_token = authorization.credentials
-    rtn = PERMISSIONS.authorise_route_for_service(
-        service=PERMISSIONS_SERVICE_NAME,
-        version=PERMISSIONS_SERVICE_VERSION,
-        route=request.scope["route"].path,
-        method=request.method,
-        token=access_token,
-        body=request.path_params,
-    ).json()
+    with tracer.start_as_current_span("permissions.authorise_route_for_service"):
+        rtn = PERMISSIONS.authorise_route_for_service(
+            service=PERMISSIONS_SERVICE_NAME,
+            version=PERMISSIONS_SERVICE_VERSION,
+            route=request.scope["route"].path,
+            method=request.method,
+            token=access_token,
+            body=request.path_params,
+        ).json()
     if rtn.get("is_authorised", False):
         return
     raise PermissionDenied
@@ -138,9 +527,78 @@ async def verify_permission_for_service_route(
 
 @handle_exceptions
 async def get_user_id(authorization: str = Depends(security)):
-    token_string = authorization.credentials
-    token_obj = jwt.decode(token_string, options={"verify_signature": False})
-    return token_obj.get("sub")
+    with tracer.start_as_current_span("get_user_id"):
+        token_string = authorization.credentials
+        token_obj = jwt.decode(token_string, options={"verify_signature": False})
+        return token_obj.get("sub")
+
+
+# Get a database session for a request.
+#
+# Requests that only read (<mode> "read") use the read engine, i.e. a replica or a read-only
+# connection pool (see database.py), and others (<mode> "write") the primary database. To read
+# their own writes (e.g. to list a job just submitted, which a replica may not have yet), users
+# who made a write request within the last READ_YOUR_WRITES_SECONDS read from the primary. The
+# window is carried in a cookie, so that it holds across workers and replicas, and also kept in
+# memory for clients that do not keep cookies (in which case it only holds within a worker).
+#
+READ = "read"
+WRITE = "write"
+READ_YOUR_WRITES_WINDOW = float(config.get("READ_YOUR_WRITES_SECONDS", default=5))
+READ_YOUR_WRITES_COOKIE = "compute_api_read_primary_until"
+RECENT_WRITERS = VersionedCache(ttl=READ_YOUR_WRITES_WINDOW)
+app.add_middleware(
+    ReadYourWritesMiddleware,
+    window=READ_YOUR_WRITES_WINDOW,
+    cookie_name=READ_YOUR_WRITES_COOKIE,
+)
+
+
+def get_db(mode: str = WRITE) -> Callable:
+    if mode == READ:
+
+        def get_read_db(request: Request, user_id: str = Depends(get_user_id)):
+            if RECENT_WRITERS.get(user_id) or wrote_recently(request, READ_YOUR_WRITES_COOKIE):
+                db = SessionLocal()
+            else:
+                db = ReadSessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        return get_read_db
+
+    def get_write_db(request: Request, user_id: str = Depends(get_user_id)):
+        RECENT_WRITERS.set(user_id, True)
+        mark_write(request)
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+            # the window starts again once the writes are committed
+            RECENT_WRITERS.set(user_id, True)
+
+    return get_write_db
+
+
+# Rate limit requests per user and route.
+#
+# This runs before the route permission check so that throttled requests do not reach the
+# Permissions API.
+#
+@handle_exceptions
+async def enforce_rate_limit(
+    request: Request, user_id: str = Depends(get_user_id)
+) -> Union[HTTPException, None]:
+    if RATE_LIMITER is None:
+        return
+    key = "{}:{}:{}".format(user_id, request.method, request.scope["route"].path)
+    with tracer.start_as_current_span("rate_limit"):
+        retry_after = await RATE_LIMITER.acquire(key)
+    if retry_after:
+        raise RateLimited(retry_after=format_retry_after(retry_after))
 
 
 # Check service route permissions from user token groups (taking token from query parameters).
@@ -151,14 +609,15 @@ async def verify_permission_for_service_route_query_params(
 ) -> Union[HTTPException, bool]:
     if token is None:
         raise PermissionDenied
-    rtn = PERMISSIONS.authorise_route_for_service(
-        service=PERMISSIONS_SERVICE_NAME,
-        version=PERMISSIONS_SERVICE_VERSION,
-        route=request.scope["route"].path,
-        method=request.method,
-        token=token,
-        body=request.path_params,
-    ).json()
+    with tracer.start_as_current_span("permissions.authorise_route_for_service"):
+        rtn = PERMISSIONS.authorise_route_for_service(
+            service=PERMISSIONS_SERVICE_NAME,
+            version=PERMISSIONS_SERVICE_VERSION,
+            route=request.scope["route"].path,
+            method=request.method,
+            token=token,
+            body=request.path_params,
+        ).json()
     if rtn.get("is_authorised", False):
         return
     raise PermissionDenied
@@ -282,7 +741,7 @@ async def user_docs(request: Request) -> TEMPLATES.TemplateResponse:
 @handle_exceptions
 async def ping(request: Request):
     """Service aliveness."""
-    return JSONResponse(
+    return ORJSONResponse(
         {
             "status": "UP",
             "version": os.environ.get("SERVICE_VERSION"),
@@ -290,6 +749,25 @@ async def ping(request: Request):
     )
 
 
+@api_version(1)
+@app.get(
+    "/metrics",
+    include_in_schema=False,
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def metrics(request: Request):
+    """Admission control metrics of this worker (Prometheus text format)."""
+    return PlainTextResponse(
+        render_metrics(ADMISSION_ROUTE_CLASSES), media_type="text/plain; version=0.0.4"
+    )
+
+
 @api_version(1)
 @app.get(
     "/health",
@@ -311,12 +789,13 @@ async def health(request: Request):
     #
     # Permissions API
     #
-    permissions_api_response = PERMISSIONS.ping()
+    with tracer.start_as_current_span("permissions.ping"):
+        permissions_api_response = PERMISSIONS.ping()
 
     # Set return code dependent on criteria e.g. dependent service statuses
     #
     healthy_criteria = [permissions_api_response.status_code == 200]
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_200_OK
         if all(healthy_criteria)
         else status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -350,8 +829,100 @@ async def health(request: Request):
 @handle_exceptions
 async def query(query_input: models.QueryInput, authorization: str = Depends(security)):
     """Query for availability"""
-    print(authorization)
-    return query_resources(query_input)
+    return render_query(query_input)
+
+
+@api_version(1)
+@app.get(
+    "/query",
+    responses={200: {"model": models.QueryResponse}},
+    tags=["Query"],
+    summary="Query for general compute availability (cacheable).",
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def query_get(
+    query_input: models.QueryInput = Depends(),
+    authorization: str = Depends(security),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """Query for availability, with the query given as query parameters.
+
+    Answers carry an ETag, and requests with a matching If-None-Match header get a 304.
+    """
+    return render_query(query_input, if_none_match)
+
+
+@api_version(1)
+@app.post(
+    "/query/batch",
+    responses={200: {"model": models.BatchQueryResponse}},
+    tags=["Query"],
+    summary="Query for the availability of many resource shapes at once.",
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def query_batch(
+    batch_input: models.BatchQueryInput, authorization: str = Depends(security)
+):
+    """Evaluate many resource shapes at once (e.g. to pick the cheapest feasible one)"""
+    return render_response(query_resources_batch(batch_input))
+
+
+@api_version(1)
+@app.post(
+    "/federation/query",
+    responses={200: {"model": models.response.FederatedQueryResponse}},
+    tags=["Query"],
+    summary="Query all federated compute sites for availability.",
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def federated_query(
+    query_input: models.QueryInput, authorization: str = Depends(security)
+):
+    """Query all federated compute sites for availability.
+
+    Sites are queried concurrently and their answers ranked by availability, then data locality,
+    then latency. The best answer is returned along with those of all sites.
+    """
+    if BROKER is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Federation is not configured."
+        )
+    sites = await BROKER.query(query_input, token=authorization.credentials)
+    if not sites:
+        return render_response(
+            models.response.FederatedQueryResponse.construct(
+                response_code=3,
+                response_text="Internal error. No compute sites are registered.",
+                site=None,
+                sites=[],
+            )
+        )
+    return render_response(
+        models.response.FederatedQueryResponse.construct(
+            response_code=sites[0]["response_code"],
+            response_text=sites[0]["response_text"],
+            site=sites[0]["site"],
+            sites=sites,
+        )
+    )
 
 
 @api_version(1)
@@ -360,21 +931,39 @@ async def query(query_input: models.QueryInput, authorization: str = Depends(sec
     responses={200: {"model": models.response.ProvisionResponse}},
     tags=["Submit"],
     summary="Query for general compute availability and provision resources.",
-    dependencies=[Depends(increment_request_counter)]
+    dependencies=[Depends(increment_request_counter), Depends(enforce_rate_limit)]
     if DEBUG
     else [
         Depends(increment_request_counter),
+        Depends(enforce_rate_limit),
         Depends(verify_permission_for_service_route),
     ],
 )
 @handle_exceptions
 async def provision(
+    request: Request,
     provision_input: models.QueryInput,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db(WRITE)),
     user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Header(default=None),
 ):
-    """Query for availability and provision resources."""
-    return provision_resources(provision_input=provision_input, db=db, user_id=user_id)
+    """Query for availability and provision resources.
+
+    Retries carrying the same Idempotency-Key header return the original response.
+    """
+
+    def operation():
+        check_provision_quota(db, user_id)
+        return provision_resources(provision_input=provision_input, db=db, user_id=user_id)
+
+    return run_idempotent(
+        db=db,
+        idempotency_key=idempotency_key,
+        user_id=user_id,
+        route=request.url.path,
+        request_input=provision_input,
+        operation=operation,
+    )
 
 
 @api_version(1)
@@ -383,23 +972,43 @@ async def provision(
     responses={200: {"model": models.response.JobSubmissionResponse}},
     tags=["Submit"],
     summary="Submit job for the provision.",
-    dependencies=[Depends(increment_request_counter)]
+    dependencies=[Depends(increment_request_counter), Depends(enforce_rate_limit)]
     if DEBUG
     else [
         Depends(increment_request_counter),
+        Depends(enforce_rate_limit),
         Depends(verify_permission_for_service_route),
     ],
 )
 @handle_exceptions
 async def submit(
+    request: Request,
     job_input: models.JobInput,
     provision_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db(WRITE)),
     user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Header(default=None),
 ):
-    """Submit job to be executed using the provision."""
-    return submit_job(
-        job_input=job_input, provision_id=provision_id, db=db, user_id=user_id
+    """Submit job to be executed using the provision.
+
+    Retries carrying the same Idempotency-Key header return the original response.
+    """
+    if job_input.callback_url:
+        await WEBHOOK_URL_POLICY.check(job_input.callback_url)
+
+    def operation():
+        check_job_quota(db, user_id)
+        return submit_job(
+            job_input=job_input, provision_id=provision_id, db=db, user_id=user_id
+        )
+
+    return run_idempotent(
+        db=db,
+        idempotency_key=idempotency_key,
+        user_id=user_id,
+        route=request.url.path,
+        request_input=job_input,
+        operation=operation,
     )
 
 
@@ -419,11 +1028,283 @@ async def submit(
 @handle_exceptions
 async def get_job_status(
     provision_id: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_db(WRITE)),  # polling advances the job's (simulated) flow
+    user_id: str = Depends(get_user_id),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """See the satus of a submitted job.
+
+    Statuses carry an ETag, and requests with a matching If-None-Match header get a 304.
+    """
+    final_etag = FINAL_STATUS_ETAGS.get((user_id, provision_id))
+    if final_etag is not None and etag_matches(if_none_match, final_etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": final_etag})
+
+    # in the threadpool, as contended polls back off (sleeping) before retrying
+    status_response, etag, final = await run_in_threadpool(
+        job_status, provision_id=provision_id, db=db, user_id=user_id
+    )
+    if etag is None:
+        return render_response(status_response)
+    if final:
+        FINAL_STATUS_ETAGS.set((user_id, provision_id), etag)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response = render_response(status_response)
+    response.headers["ETag"] = etag
+    return response
+
+
+@api_version(1)
+@app.get(
+    "/provisions",
+    responses={200: {"model": models.response.ProvisionListResponse}},
+    tags=["Submit"],
+    summary="List provisions.",
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def get_provisions(
+    active: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: Session = Depends(get_db(READ)),
+    user_id: str = Depends(get_user_id),
+):
+    """List your provisions, newest first.
+
+    Provisions can be filtered by whether they are still valid (<active>) and by their validity
+    (<since> <= validity < <until>). If there are more than <limit>, pass the returned next_cursor
+    as <cursor> to get the next page.
+    """
+    return render_response(
+        list_provisions(
+            db=db,
+            user_id=user_id,
+            active=active,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit,
+        )
+    )
+
+
+@api_version(1)
+@app.get(
+    "/jobs",
+    responses={200: {"model": models.response.JobListResponse}},
+    tags=["Submit"],
+    summary="List jobs.",
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def get_jobs(
+    running: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: Session = Depends(get_db(READ)),
     user_id: str = Depends(get_user_id),
 ):
-    """See the satus of a submitted job."""
-    return job_status(provision_id=provision_id, db=db, user_id=user_id)
+    """List your jobs, newest first.
+
+    Jobs can be filtered by whether they are still <running> and by the validity of their
+    provision (<since> <= validity < <until>). If there are more than <limit>, pass the returned
+    next_cursor as <cursor> to get the next page. Archived jobs are listed too.
+    """
+    return render_response(
+        list_jobs(
+            db=db,
+            user_id=user_id,
+            running=running,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit,
+        )
+    )
+
+
+@api_version(1)
+@app.put(
+    "/admin/profile",
+    include_in_schema=False,
+    responses={200: {"model": models.response.GenericOperationResponse}},
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def arm_profiler(request: Request, path: str = ".*"):
+    """Profile the next request with a path matching the regular expression <path>."""
+    PROFILER.arm(path)
+    return ORJSONResponse({"successful": True})
+
+
+@api_version(1)
+@app.get(
+    "/admin/profile/{profile_id}",
+    include_in_schema=False,
+    dependencies=[Depends(increment_request_counter)]
+    if DEBUG
+    else [
+        Depends(increment_request_counter),
+        Depends(verify_permission_for_service_route),
+    ],
+)
+@handle_exceptions
+async def get_profile(request: Request, profile_id: str):
+    """Get a stored request profile (speedscope format)."""
+    profile_path = PROFILER.get_profile_path(profile_id)
+    if profile_path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found.")
+    return FileResponse(profile_path, media_type="application/json")
+
+
+# Archive completed jobs periodically in the background.
+#
+def archive_jobs() -> int:
+    db = SessionLocal()
+    try:
+        return crud.archive_completed_jobs(
+            db, older_than=ARCHIVE_JOBS_AFTER, batch_size=ARCHIVE_BATCH_SIZE
+        )
+    finally:
+        db.close()
+
+
+async def run_job_archiver():
+    await BACKGROUND_TASKS_LOCK.wait(BACKGROUND_TASKS_LOCK_INTERVAL)
+    while True:
+        try:
+            start = time.perf_counter()
+            archived = await run_in_threadpool(archive_jobs)
+            if archived:
+                logger.info(
+                    "jobs archived",
+                    extra={
+                        "event": "archive_jobs",
+                        "jobs": archived,
+                        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                    },
+                )
+        except Exception:
+            logger.exception("job archival failed", extra={"event": "archive_jobs"})
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_job_archiver():
+    global ARCHIVER_TASK
+    if ARCHIVE_JOBS_AFTER:
+        ARCHIVER_TASK = asyncio.create_task(run_job_archiver())
+
+
+@app.on_event("shutdown")
+async def stop_job_archiver():
+    if ARCHIVER_TASK is not None:
+        ARCHIVER_TASK.cancel()
+
+
+# Deliver email and webhook notifications from the outbox in the background.
+#
+def delete_old_notifications() -> int:
+    db = SessionLocal()
+    try:
+        return crud.delete_old_notifications(db, older_than=NOTIFICATION_RETENTION)
+    finally:
+        db.close()
+
+
+async def run_notification_dispatcher(dispatch_once: Callable, batch_size: int, interval: float):
+    await BACKGROUND_TASKS_LOCK.wait(BACKGROUND_TASKS_LOCK_INTERVAL)
+    while True:
+        try:
+            # keep draining while batches are full
+            while await dispatch_once() == batch_size:
+                pass
+        except Exception:
+            logger.exception("notification dispatch failed", extra={"event": "notification"})
+        await asyncio.sleep(interval)
+
+
+async def run_notification_purge():
+    await BACKGROUND_TASKS_LOCK.wait(BACKGROUND_TASKS_LOCK_INTERVAL)
+    while True:
+        try:
+            await run_in_threadpool(delete_old_notifications)
+        except Exception:
+            logger.exception("notification purge failed", extra={"event": "notification"})
+        await asyncio.sleep(3600)
+
+
+@app.on_event("startup")
+async def start_notification_dispatchers():
+    NOTIFICATION_TASKS.extend(
+        [
+            asyncio.create_task(
+                run_notification_dispatcher(
+                    lambda: run_in_threadpool(NOTIFICATION_DISPATCHER.dispatch_once),
+                    NOTIFICATION_DISPATCHER.batch_size,
+                    NOTIFICATION_INTERVAL,
+                )
+            ),
+            asyncio.create_task(
+                run_notification_dispatcher(
+                    WEBHOOK_DISPATCHER.dispatch_once,
+                    WEBHOOK_DISPATCHER.batch_size,
+                    WEBHOOK_INTERVAL,
+                )
+            ),
+            asyncio.create_task(run_notification_purge()),
+        ]
+    )
+
+
+@app.on_event("shutdown")
+async def stop_notification_dispatchers():
+    for task in NOTIFICATION_TASKS:
+        task.cancel()
+    NOTIFICATION_DISPATCHER.close()
+    await WEBHOOK_DISPATCHER.aclose()
+
+
+# Close the federation broker's connections on shutdown.
+#
+@app.on_event("shutdown")
+async def close_broker():
+    if BROKER is not None:
+        await BROKER.aclose()
+
+
+# Re-create per-process resources in a worker forked from a preloaded app (see
+# etc/docker/gunicorn.conf.py).
+#
+# Database connections opened before the fork (e.g. to create the schema) must not be used by more
+# than one process, so they are dropped from the workers' pools without being closed. The HTTP
+# clients, the redis connection pool and the background tasks are only used (or started) once the
+# worker's event loop runs.
+#
+def reinitialise_after_fork():
+    for database_engine in DATABASE_ENGINES:
+        database_engine.dispose(close=False)
 
 
 # Versionise the API.
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import ska_src_compute_api.database.models  # noqa: E402,F401
+from ska_src_compute_api.database.database import Base  # noqa: E402
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    """Session factory for a fresh sqlite database (a file, so that it can be shared by threads)."""
+    engine = create_engine(
+        "sqlite:///{}".format(tmp_path / "compute.db"),
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(sessions):
+    session = sessions()
+    yield session
+    session.close()
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+import ska_src_compute_api.database.models as db_models
+from ska_src_compute_api.database import crud
+
+
+def add_job(db, user_id, validity, flow_stage):
+    provision = db_models.Provisions(user_id=user_id, validity=validity)
+    db.add(provision)
+    db.flush()
+    job = db_models.Jobs(
+        user_id=user_id, container="c", params={}, dataset="d", provision=provision.id
+    )
+    db.add(job)
+    db.flush()
+    db.add(db_models.JobStatus(job=job.id, flow="happy_flow", flow_stage=flow_stage))
+    db.commit()
+    return job.id
+
+
+def test_list_jobs_across_archive(db):
+    final_stage = len(crud.flows["happy_flow"])
+    expired = datetime.now() - timedelta(days=2)
+    archived = [add_job(db, "user", expired, final_stage) for _ in range(3)]
+    running = [add_job(db, "user", datetime.now() + timedelta(days=1), 0) for _ in range(2)]
+    add_job(db, "other", expired, final_stage)
+    assert crud.archive_completed_jobs(db, older_than=timedelta(days=1)) == 4
+    expected = sorted(archived + running, reverse=True)
+
+    assert [job.job_id for job in crud.list_jobs(db, "user")] == expected
+    assert [job.job_id for job in crud.list_jobs(db, "user", running=True)] == running[::-1]
+    assert [job.job_id for job in crud.list_jobs(db, "user", running=False)] == archived[::-1]
+
+    # pages of 2 cross from the jobs table to the archive
+    listed, before_id = [], None
+    while True:
+        page = crud.list_jobs(db, "user", before_id=before_id, limit=2)
+        listed += [job.job_id for job in page]
+        if len(page) < 2:
+            break
+        before_id = page[-1].job_id
+    assert listed == expected
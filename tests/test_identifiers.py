@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from ska_src_compute_api.common.exceptions import InvalidIdentifier
+from ska_src_compute_api.common.identifiers import (
+    IdentifierCodec,
+    JOB,
+    MAX_IDENTIFIER_LENGTH,
+    PROVISION,
+)
+
+CODECS = [IdentifierCodec("spsrc"), IdentifierCodec("spsrc", key="test")]
+KINDS = [(PROVISION, JOB), (JOB, PROVISION)]
+
+
+def random_numbers(count=1000, seed=0):
+    rng = random.Random(seed)
+    return [0] + [rng.randrange(2 ** rng.randrange(1, 63)) for _ in range(count)]
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=["unsigned", "signed"])
+@pytest.mark.parametrize("kind", [PROVISION, JOB])
+def test_round_trip(codec, kind):
+    for number in random_numbers():
+        assert codec.decode(codec.encode(number, kind), kind) == number
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=["unsigned", "signed"])
+@pytest.mark.parametrize("kind, other_kind", KINDS)
+def test_wrong_kind_or_site_rejected(codec, kind, other_kind):
+    for number in random_numbers(100):
+        identifier = codec.encode(number, kind)
+        with pytest.raises(InvalidIdentifier):
+            codec.decode(identifier, other_kind)
+        with pytest.raises(InvalidIdentifier):
+            codec.decode("other" + identifier, kind)
+
+
+@pytest.mark.parametrize("kind, other_kind", KINDS)
+def test_tampered_signature_rejected(kind, other_kind):
+    codec = CODECS[1]
+    for number in random_numbers(100):
+        signature = codec.encode(number, kind)[: -len(kind) - 1].rpartition(".")[2]
+        other_number = codec.encode(number + 1, kind)[: -len(kind) - 1].rpartition(".")[0]
+        with pytest.raises(InvalidIdentifier):
+            codec.decode("{}.{}.{}".format(other_number, signature, kind), kind)
+
+
+def test_signed_ids_rejected_with_another_key():
+    identifier = CODECS[1].encode(12, PROVISION)
+    with pytest.raises(InvalidIdentifier):
+        IdentifierCodec("spsrc", key="other").decode(identifier, PROVISION)
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=["unsigned", "signed"])
+@pytest.mark.parametrize(
+    "identifier",
+    [
+        "",
+        "spsrc-.prov",
+        "-12.prov",
+        "spsrc-12",
+        "spsrc-1x.prov",
+        "spsrc-" + "1-" * 100 + "x.prov",
+        "spsrc-" + "1" * MAX_IDENTIFIER_LENGTH + ".prov",
+        None,
+    ],
+)
+def test_malformed_rejected(codec, identifier):
+    with pytest.raises(InvalidIdentifier):
+        codec.decode(identifier, PROVISION)
@@ -0,0 +1,62 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from ska_src_compute_api import models as api_models
+from ska_src_compute_api.common.data_locality import DataLocationIndex
+from ska_src_compute_api.common.identifiers import IdentifierCodec, PROVISION
+from ska_src_compute_api.database import crud
+
+IDS = IdentifierCodec("spsrc")
+
+
+def add_jobs(db, count):
+    data_locations = DataLocationIndex([{"host": "skao.int", "sites": ["spsrc"]}])
+    query = api_models.QueryInput(
+        data_location="SPSRC",
+        data_size=1,
+        output_data_size=1,
+        memory=1,
+        cpu_cores=1,
+        runtime=1,
+        deadline=datetime.now() + timedelta(days=1),
+    )
+    job = api_models.JobInput(
+        container="c", dataset="https://webdav.data.skao.int/dataproduct.fits", params={}
+    )
+    provision_ids = []
+    for _ in range(count):
+        provision_id = IDS.encode(crud.add_provision(db, query, "user").id, PROVISION)
+        crud.add_job(db, job, provision_id, "spsrc", "user", data_locations, IDS)
+        provision_ids.append(provision_id)
+    return provision_ids
+
+
+def test_parallel_polls_report_each_stage_once(db, sessions, monkeypatch):
+    # enough attempts that no poll is rejected, so that every poll reports a stage
+    monkeypatch.setattr(crud, "JOB_STATUS_UPDATE_ATTEMPTS", 100)
+    pollers = 8
+    provision_ids = add_jobs(db, 20)
+    barrier = threading.Barrier(pollers)
+    reported = {provision_id: [] for provision_id in provision_ids}
+
+    def poll():
+        for provision_id in provision_ids:
+            barrier.wait()
+            session = sessions()
+            try:
+                _, (_, stage, _) = crud.get_job_status(session, provision_id, "user", IDS)
+            finally:
+                session.close()
+            reported[provision_id].append(stage)
+
+    with ThreadPoolExecutor(max_workers=pollers) as executor:
+        for future in [executor.submit(poll) for _ in range(pollers)]:
+            future.result()
+
+    final_stage = len(crud.flows["happy_flow"]) - 1
+    expected = Counter(range(final_stage))
+    expected[final_stage] = pollers - final_stage
+    for stages in reported.values():
+        assert Counter(stages) == expected